@@ -13,16 +13,126 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # =================================================================
-from typing import Callable, Self
-
-import jsonschema
+import functools
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Self
+
+import jsonschema_rs
+import orjson
 from pygeoapi.api import *
 from pygeoapi.provider.base import ProviderItemNotFoundError
 
-from pygeoapi.util import filter_dict_by_key_value, render_j2_template, to_json
+from pygeoapi.util import filter_dict_by_key_value, render_j2_template, to_json, json_serial
 from provider.definitions import *
 
-from jsonschema import validate
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas", "connected-systems")
+
+# JSON schemas used to validate POSTed entities, keyed by collection name
+CSA_SCHEMAS_PART1 = {
+    "system": os.path.join(SCHEMA_DIR, "system.schema"),
+    "procedure": os.path.join(SCHEMA_DIR, "procedure.schema"),
+    "property": os.path.join(SCHEMA_DIR, "property.schema"),
+    "samplingFeature": os.path.join(SCHEMA_DIR, "samplingFeature.schema"),
+    "deployment": os.path.join(SCHEMA_DIR, "deployment.schema"),
+}
+CSA_SCHEMAS_PART2 = {
+    "datastream": os.path.join(SCHEMA_DIR, "datastream.schema"),
+    "observation": os.path.join(SCHEMA_DIR, "observation.schema"),
+}
+
+TEMPLATE_LANDING_PAGE = 'templates/landing_page.html'
+TEMPLATE_COLLECTION_ITEM = 'templates/connected-systems/collection/item.html'
+TEMPLATE_COLLECTION_OVERVIEW = 'templates/connected-systems/collection/overview.html'
+
+# (lowercase) formats accepted by Connected Systems endpoints in addition to the pygeoapi defaults
+CSA_FORMATS = frozenset(mime.lower() for mime in FORMAT_TYPES.values())
+
+# url-encoded format parameter values, keyed by format name
+FORMAT_PARAMS = {name: mime.replace("+", "%2B") for name, mime in FORMAT_TYPES.items()}
+
+# formats served by the samplingFeatures endpoint
+SAMPLING_FEATURE_FORMATS = frozenset((FORMAT_TYPES[F_JSON], FORMAT_TYPES[F_GEOJSON]))
+
+# valid entity identifiers in request paths
+ENTITY_ID_PATTERN = re.compile(r"^[\w-]+\Z")
+
+# maximum accepted size of request bodies in bytes, enforced by quart through MAX_CONTENT_LENGTH
+MAX_BODY_BYTES = int(os.environ.get("CSA_MAX_BODY", 16 * 1024 * 1024))
+# POSTed request bodies must contain a json object or array
+JSON_BODY_START = re.compile(rb"[ \t\r\n]*[{\[]")
+
+# serialize timestamps as RFC 3339 UTC and numpy values natively
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY
+
+# opening fragments of serialized collection responses
+FEATURE_COLLECTION_PREFIX = b'{"type":"FeatureCollection","features":'
+ITEMS_PREFIX = b'{"items":'
+
+
+@functools.lru_cache(maxsize=None)
+def load_validator(location: str) -> jsonschema_rs.Draft7Validator:
+    """
+    Compiles the json schema at the given location into a validator.
+    Validators are cached so every schema is compiled only once per process.
+
+    :param location: path to the json schema
+
+    :returns: compiled validator
+    """
+    with open(location, 'rb') as definition:
+        return jsonschema_rs.validator_for(orjson.loads(definition.read()))
+
+
+def serialize_collection(prefix: bytes, items: List[Dict], links: List[Dict]) -> bytes:
+    """
+    Serializes a collection response by concatenating the serialized items and links
+    with static fragments instead of building and serializing an enclosing dict.
+
+    :param prefix: opening fragment of the response, up to the items array
+    :param items: collection members
+    :param links: collection links
+
+    :returns: serialized response
+    """
+    return (prefix
+            + orjson.dumps(items, default=json_serial, option=ORJSON_OPTIONS)
+            + b',"links":'
+            + orjson.dumps(links, default=json_serial, option=ORJSON_OPTIONS)
+            + b'}')
+
+
+def serialize_json(data, pretty_print: bool = False) -> bytes:
+    """
+    Serializes a CSA response. Unlike `to_json`, this passes pre-encoded `orjson.Fragment` members through as-is.
+
+    :param data: response content
+    :param pretty_print: whether to indent the output
+
+    :returns: serialized response
+    """
+    option = (ORJSON_OPTIONS | orjson.OPT_INDENT_2) if pretty_print else ORJSON_OPTIONS
+    return orjson.dumps(data, default=json_serial, option=option)
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """
+    Evaluates an If-None-Match header against the ETag of a response, using weak comparison (RFC 9110).
+
+    :param etag: quoted ETag of the response
+    :param if_none_match: raw If-None-Match header, if any
+
+    :returns: whether the header lists the ETag or is `*`
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip().removeprefix('W/')
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
 
 
 class AsyncAPIRequest(APIRequest):
@@ -43,13 +153,10 @@ def process(func):
     :returns: `func`
     """
 
-    async def inner(*args):
-        cls, req_in = args[:2]
+    @functools.wraps(func)
+    async def inner(cls, req_in, *args):
         req_out = await AsyncAPIRequest.with_data(req_in, getattr(cls, 'locales', set()))
-        if len(args) > 2:
-            return await func(cls, req_out, *args[2:])
-        else:
-            return await func(cls, req_out)
+        return await func(cls, req_out, *args)
 
     return inner
 
@@ -58,11 +165,14 @@ class CSAPI(API):
     csa_provider_part1: ConnectedSystemsPart1Provider | None
     csa_provider_part2: ConnectedSystemsPart2Provider | None
 
-    csa_schemas = {}
+    csa_validators: Dict[str, jsonschema_rs.Draft7Validator] = {}
 
     def __init__(self, config, openapi):
         super().__init__(config, openapi)
 
+        # rendered HTML of pages that only depend on configuration and locale
+        self._static_pages: Dict[Tuple[str, str], str] = {}
+
         if config['dynamic-resources'] is not None:
             api_part1 = config['dynamic-resources'].get('connected-systems-api-part1', None)
             if api_part1 is not None:
@@ -74,13 +184,7 @@ class CSAPI(API):
                     self.config['resources'] = {}
 
                 # TODO: refresh this upon modification of the datastore (e.g. adding new collections)
-                for name, location in [("system", "schemas/connected-systems/system.schema"),
-                                       ("procedure", "schemas/connected-systems/procedure.schema"),
-                                       ("property", "schemas/connected-systems/property.schema"),
-                                       ("samplingFeature", "schemas/connected-systems/samplingFeature.schema"),
-                                       ("deployment", "schemas/connected-systems/deployment.schema")]:
-                    with open(location, 'r') as definition:
-                        self.csa_schemas[name] = json.load(definition)
+                self._compile_schemas(CSA_SCHEMAS_PART1)
             api_part2 = config['dynamic-resources'].get('connected-systems-api-part2', None)
 
             if api_part2 is not None:
@@ -91,13 +195,36 @@ class CSAPI(API):
                 if self.config.get('resources') is None:
                     self.config['resources'] = {}
 
-                for name, location in [
-                    ("datastream", "schemas/connected-systems/datastream.schema"),
-                    ("observation", "schemas/connected-systems/observation.schema")
-                ]:
-                    with open(location, 'r') as definition:
-                        self.csa_schemas[name] = json.load(definition)
-                    pass
+                self._compile_schemas(CSA_SCHEMAS_PART2)
+
+    def _compile_schemas(self, schemas: Dict[str, str]) -> None:
+        """
+        Compiles the given json schemas into validators and registers them by collection name
+
+        :param schemas: mapping of collection name to schema location
+        """
+        with ThreadPoolExecutor(max_workers=min(8, len(schemas))) as executor:
+            validators = executor.map(load_validator, schemas.values())
+            for name, validator in zip(schemas.keys(), validators):
+                self.csa_validators[name] = validator
+
+    def _render_static_page(self, template: str, content: dict, locale) -> str:
+        """
+        Renders a template whose content only depends on the configuration and locale.
+        Rendered pages are kept for the lifetime of the process.
+
+        :param template: template path
+        :param content: template content
+        :param locale: locale of the response
+
+        :returns: rendered page
+        """
+        key = (template, str(locale))
+        page = self._static_pages.get(key)
+        if page is None:
+            page = render_j2_template(self.tpl_config, template, content, locale)
+            self._static_pages[key] = page
+        return page
 
     @process
     @jsonldify
@@ -114,21 +241,12 @@ class CSAPI(API):
             # TODO: what to return here?
             raise NotImplementedError()
 
-        # Start new response object if resources is empty, else reuse existing object
-        fcm = None
-        if template[1] == HTTPStatus.NOT_FOUND:
-            fcm = {"collections": [], "links": []}
-        else:
-            fcm = json.loads(template[2])
-
         # query collections
         data = None
         try:
-            if collection_id is not None:
-                request.params['id'] = collection_id
-
             parameters = parse_query_parameters(CollectionParams(), request.params,
-                                                self.base_url + "/" + request.path_info)
+                                                self.base_url + "/" + request.path_info,
+                                                {"id": collection_id} if collection_id is not None else None)
             parameters.format = original_format
             data = await self.csa_provider_part1.query_collections(parameters)
         except ProviderItemNotFoundError:
@@ -144,7 +262,7 @@ class CSAPI(API):
                 if original_format == F_HTML:  # render
                     headers["Content-Type"] = "text/html"
                     content = render_j2_template(self.tpl_config,
-                                                 'templates/connected-systems/collection/item.html',
+                                                 TEMPLATE_COLLECTION_ITEM,
                                                  fcm,
                                                  request.locale)
                     return headers, HTTPStatus.OK, content
@@ -152,6 +270,11 @@ class CSAPI(API):
                     headers["Content-Type"] = "application/json"
                     return headers, HTTPStatus.OK, to_json(fcm, self.pretty_print)
             else:
+                # Start new response object if resources is empty, else reuse existing object
+                if template[1] == HTTPStatus.NOT_FOUND:
+                    fcm = {"collections": [], "links": []}
+                else:
+                    fcm = orjson.loads(template[2])
                 fcm['collections'].extend(coll for _, coll in data.items())
                 if original_format == F_HTML:  # render
                     fcm['collections_path'] = self.get_collections_url()
@@ -165,7 +288,10 @@ class CSAPI(API):
                     headers["Content-Type"] = "application/json"
                     return headers, HTTPStatus.OK, to_json(fcm, self.pretty_print)
 
-        return headers, HTTPStatus.OK, to_json(fcm, self.pretty_print)
+        if template[1] == HTTPStatus.NOT_FOUND:
+            return headers, HTTPStatus.OK, to_json({"collections": [], "links": []}, self.pretty_print)
+        # nothing to add, existing content is returned as-is
+        return headers, HTTPStatus.OK, template[2]
 
     @process
     @jsonldify
@@ -259,8 +385,7 @@ class CSAPI(API):
                 fcm['connected-systems'] = True
                 fcm['collection'] = True
 
-            content = render_j2_template(self.tpl_config, 'templates/landing_page.html',
-                                         fcm, request.locale)
+            content = self._render_static_page(TEMPLATE_LANDING_PAGE, fcm, request.locale)
             return headers, HTTPStatus.OK, content
 
         if request.format == F_JSONLD:
@@ -293,8 +418,7 @@ class CSAPI(API):
 
         headers = request.get_response_headers(**self.api_headers)
         if request.format == F_HTML:  # render
-            content = render_j2_template(self.tpl_config, 'conformance.html',
-                                         conformance, str(request.locale))
+            content = self._render_static_page('conformance.html', conformance, str(request.locale))
             return headers, HTTPStatus.OK, content
 
         return headers, HTTPStatus.OK, to_json(conformance, self.pretty_print)
@@ -348,32 +472,32 @@ class CSAPI(API):
 
         content['endpoints'].append({
             'title': f'Systems',
-            'href': f'{url}/systems?f={FORMAT_TYPES[F_JSON].replace("+", "%2B")}',
+            'href': f'{url}/systems?f={FORMAT_PARAMS[F_JSON]}',
             'type': F_JSON,
             'description': "Systems"
         })
         content['endpoints'].append({
             'title': f'Systems',
-            'href': f'{url}/systems?f={FORMAT_TYPES[F_SENSORML_JSON].replace("+", "%2B")}',
+            'href': f'{url}/systems?f={FORMAT_PARAMS[F_SENSORML_JSON]}',
             'type': F_SENSORML_JSON,
             'description': "Systems"
         })
         content['endpoints'].append({
             'title': f'Systems',
-            'href': f'{url}/systems?f={FORMAT_TYPES[F_GEOJSON].replace("+", "%2B")}',
+            'href': f'{url}/systems?f={FORMAT_PARAMS[F_GEOJSON]}',
             'type': F_GEOJSON,
             'description': "Systems"
         })
         content['endpoints'].append({
             'title': f'Procedures',
-            'href': f'{url}/procedures?f={FORMAT_TYPES[F_GEOJSON].replace("+", "%2B")}',
+            'href': f'{url}/procedures?f={FORMAT_PARAMS[F_GEOJSON]}',
             'type': F_GEOJSON,
             'description': "Procedures provides information about the procedure implemented by a system to accomplish "
                            "its task(s)."
         })
         content['endpoints'].append({
             'title': f'Procedures',
-            'href': f'{url}/procedures?f={FORMAT_TYPES[F_SENSORML_JSON].replace("+", "%2B")}',
+            'href': f'{url}/procedures?f={FORMAT_PARAMS[F_SENSORML_JSON]}',
             'type': F_SENSORML_JSON,
             'description': "Procedures provides information about the procedure implemented by a system to accomplish "
                            "its task(s)."
@@ -381,52 +505,50 @@ class CSAPI(API):
 
         content['endpoints'].append({
             'title': f'Deployments',
-            'href': f'{url}/deployments?f={FORMAT_TYPES[F_GEOJSON].replace("+", "%2B")}',
+            'href': f'{url}/deployments?f={FORMAT_PARAMS[F_GEOJSON]}',
             'type': F_GEOJSON,
             'description': "Deployments describe how systems are being deployed at a particular place and time."
         })
         content['endpoints'].append({
             'title': f'Deployments',
-            'href': f'{url}/deployments?f={FORMAT_TYPES[F_SENSORML_JSON].replace("+", "%2B")}',
+            'href': f'{url}/deployments?f={FORMAT_PARAMS[F_SENSORML_JSON]}',
             'type': F_SENSORML_JSON,
             'description': "Deployments describe how systems are being deployed at a particular place and time."
         })
 
         content['endpoints'].append({
             'title': f'SamplingFeatures',
-            'href': f'{url}/samplingFeatures?f={FORMAT_TYPES[F_GEOJSON].replace("+", "%2B")}',
+            'href': f'{url}/samplingFeatures?f={FORMAT_PARAMS[F_GEOJSON]}',
             'type': F_GEOJSON,
             'description': "Sampling Features link Systems with ultimate features of interest, describing exactly what part of a larger feature is being interacted with."
         })
         content['endpoints'].append({
             'title': f'Properties',
-            'href': f'{url}/properties?f={FORMAT_TYPES[F_SENSORML_JSON].replace("+", "%2B")}',
+            'href': f'{url}/properties?f={FORMAT_PARAMS[F_SENSORML_JSON]}',
             'type': F_SENSORML_JSON,
             'description': "List or search all Property resources available from this server endpoint."
         })
         content['endpoints'].append({
             'title': f'Datastreams',
-            'href': f'{url}/datastreams?f={FORMAT_TYPES[F_JSON].replace("+", "%2B")}',
+            'href': f'{url}/datastreams?f={FORMAT_PARAMS[F_JSON]}',
             'type': F_JSON,
             'description': "Datastreams allow access to observations produced by systems, in various formats."
         })
         content['endpoints'].append({
             'title': f'Observations',
-            'href': f'{url}/observations?f={FORMAT_TYPES[F_OM_JSON].replace("+", "%2B")}',
+            'href': f'{url}/observations?f={FORMAT_PARAMS[F_OM_JSON]}',
             'type': F_OM_JSON,
             'description': "List or search all observations available from this server endpoint."
         })
         content['endpoints'].append({
             'title': f'Observations',
-            'href': f'{url}/observations?f={FORMAT_TYPES[F_SWE_JSON].replace("+", "%2B")}',
+            'href': f'{url}/observations?f={FORMAT_PARAMS[F_SWE_JSON]}',
             'type': F_SWE_JSON,
             'description': "List or search all observations available from this server endpoint."
         })
 
         if request.format == F_HTML:  # render
-            content = render_j2_template(self.tpl_config,
-                                         'templates/connected-systems/collection/overview.html',
-                                         content, request.locale)
+            content = self._render_static_page(TEMPLATE_COLLECTION_OVERVIEW, content, request.locale)
             return headers, HTTPStatus.OK, content
 
         return headers, HTTPStatus.OK, to_json(content, self.pretty_print)
@@ -466,7 +588,7 @@ class CSAPI(API):
             self,
             request: AsyncAPIRequest,
             path: Union[Tuple[str, str], None] = None) -> Tuple[dict, int, str]:
-        if request.format == FORMAT_TYPES[F_JSON] or request.format == FORMAT_TYPES[F_GEOJSON]:
+        if request.format in SAMPLING_FEATURE_FORMATS:
             return await self._handle_get(request,
                                           path,
                                           self.csa_provider_part1.query_sampling_features,
@@ -482,7 +604,7 @@ class CSAPI(API):
         return await self._handle_get(request,
                                       path,
                                       self.csa_provider_part1.query_properties,
-                                      CSAParams())
+                                      PropertiesParams())
 
     @process
     async def get_datastreams(
@@ -643,15 +765,17 @@ class CSAPI(API):
             # TODO: what to return here?
             raise NotImplementedError()
 
-        if not request.is_valid(FORMAT_TYPES.values()):
+        # equivalent to request.is_valid(FORMAT_TYPES.values()) with an O(1) check for CSA formats
+        if request.format not in CSA_FORMATS and not request.is_valid():
             return self.get_format_exception(request)
         headers = request.get_response_headers(**self.api_headers)
 
         collection = True
+        path_parameters = None
         # Expand parameters with additional information based on path
         if path is not None:
             # Check that id is not malformed.
-            if not re.match("^[\w-]+$", path[1]):
+            if not ENTITY_ID_PATTERN.match(path[1]):
                 return self.get_exception(
                     HTTPStatus.BAD_REQUEST,
                     headers,
@@ -661,14 +785,15 @@ class CSAPI(API):
 
             # TODO: does the case exist where a property is specified both
             #  in url and query params and we overwrite stuff here?
-            request.params[path[0]] = path[1]
+            path_parameters = {path[0]: path[1]}
 
             if path[0] == "id":
                 collection = False
 
         # parse parameters
         try:
-            parameters = parse_query_parameters(params, request.params, self.base_url + "/" + request.path_info)
+            parameters = parse_query_parameters(params, request.params, self.base_url + "/" + request.path_info,
+                                                path_parameters)
             parameters.format = request.format
             data = await handler(parameters)
 
@@ -700,26 +825,54 @@ class CSAPI(API):
         # TODO: validate that POST is supported by provider
         # TODO: check format
         headers = request.get_response_headers(**self.api_headers)
-        entities = json.loads(request.data)
+
+        # reject obviously malformed payloads before invoking the parser.
+        # oversize bodies are already refused with 413 by quart while reading (MAX_CONTENT_LENGTH)
+        if not JSON_BODY_START.match(request.data):
+            return self.get_exception(
+                HTTPStatus.BAD_REQUEST,
+                headers,
+                request.format,
+                'InvalidParameterValue',
+                "request body must be a json object or array")
+
+        # parse raw bytes directly, avoiding an intermediate str copy of the whole body
+        try:
+            entities = orjson.loads(request.data)
+        except orjson.JSONDecodeError as ex:
+            return self.get_exception(
+                HTTPStatus.BAD_REQUEST,
+                headers,
+                request.format,
+                'InvalidParameterValue',
+                f"invalid json at position {ex.pos}: {ex.msg}")
 
         # unify posting single and multiple entities
         if type(entities) != list:
             entities = [entities]
 
-        # Validate against json schema
-        schema = self.csa_schemas[collection_name]
+        # Validate against precompiled json schema
+        validator = self.csa_validators.get(collection_name)
+        if validator is None:
+            return self.get_exception(
+                HTTPStatus.BAD_REQUEST,
+                headers,
+                request.format,
+                'InvalidParameterValue',
+                f"no schema available for {collection_name}")
         try:
             for elem in entities:
-                validate(instance=elem, schema=schema)
+                if path is None and "parent" in elem:
+                    # remove additional fields that cannot be set using POST/PUT but only through reference in URL
+                    # before running the (comparatively expensive) schema validation
+                    elem["parent"] = None
+                if not validator.is_valid(elem):
+                    # only materialize the error description for invalid entities
+                    validator.validate(elem)
                 if path is not None:
                     elem[path[0]] = path[1]
-                else:
-                    # remove additional fields that cannot be set using POST/PUT but only through reference in URL
-                    # but passes validation
-                    if "parent" in elem:
-                        elem["parent"] = None
 
-        except jsonschema.exceptions.ValidationError as ex:
+        except jsonschema_rs.ValidationError as ex:
             return self.get_exception(
                 HTTPStatus.BAD_REQUEST,
                 headers,
@@ -753,20 +906,29 @@ class CSAPI(API):
 
         headers = request.get_response_headers(**self.api_headers)
         try:
-            request_params = request.params
-            if item_id:
-                request_params['id'] = item_id
-
-            parameters = parse_query_parameters(CollectionParams(), request_params,
-                                                self.base_url + "/" + request.path_info)
+            parameters = parse_query_parameters(CollectionParams(), request.params,
+                                                self.base_url + "/" + request.path_info,
+                                                {"id": item_id} if item_id else None)
             data = await self.csa_provider_part1.query_collection_items(collection_id, parameters)
             return self._format_csa_response(request, headers, data, item_id is None)
         except ProviderItemNotFoundError:
             return headers, HTTPStatus.NOT_FOUND, ""
 
     def _format_csa_response(self, request, headers, data, is_collection: bool) -> Tuple[dict, int, str]:
-        if FORMAT_TYPES.get(request.format):
-            headers['Content-Type'] = FORMAT_TYPES.get(request.format)
+        headers, status, content = self._render_csa_response(request, headers, data, is_collection)
+        if status == HTTPStatus.OK:
+            # tag responses by content so clients can revalidate instead of downloading the response again
+            body = content if isinstance(content, bytes) else content.encode()
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            headers['ETag'] = etag
+            if etag_matches(etag, request.headers.get('If-None-Match')):
+                return headers, HTTPStatus.NOT_MODIFIED, ""
+        return headers, status, content
+
+    def _render_csa_response(self, request, headers, data, is_collection: bool) -> Tuple[dict, int, str]:
+        content_type = FORMAT_TYPES.get(request.format)
+        if content_type:
+            headers['Content-Type'] = content_type
 
         if data is None:
             return headers, HTTPStatus.NOT_FOUND, ""
@@ -775,24 +937,28 @@ class CSAPI(API):
             return headers, HTTPStatus.OK, "[]"
 
         if request.format == F_GEOJSON:
+            if is_collection and not self.pretty_print:
+                return headers, HTTPStatus.OK, serialize_collection(FEATURE_COLLECTION_PREFIX, data[0], data[1])
             response = {
                 "type": "FeatureCollection",
-                "features": [item for item in data[0]],
-                "links": [link for link in data[1]],
+                "features": data[0],
+                "links": data[1],
             } if is_collection else data[0][0]
-            return headers, HTTPStatus.OK, to_json(response, self.pretty_print)
+            return headers, HTTPStatus.OK, serialize_json(response, self.pretty_print)
         else:
+            if is_collection and request.format != F_HTML and not self.pretty_print:
+                return headers, HTTPStatus.OK, serialize_collection(ITEMS_PREFIX, data[0], data[1])
             response = {
-                "items": [item for item in data[0]],
-                "links": [link for link in data[1]],
+                "items": data[0],
+                "links": data[1],
             } if is_collection else data[0][0]
             if request.format == F_HTML:
                 # Some nicer formatting
                 pretty = f"""
                 <html><body><pre><code>
-                {to_json(response, True)}
+                {serialize_json(response, True).decode()}
                 </code></pre></body></html>
                 """
                 return headers, HTTPStatus.OK, pretty
             else:
-                return headers, HTTPStatus.OK, to_json(response, self.pretty_print)
+                return headers, HTTPStatus.OK, serialize_json(response, self.pretty_print)
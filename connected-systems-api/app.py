@@ -39,17 +39,18 @@ APP = CustomQuart(__name__,
                   static_folder=os.path.join(os.path.dirname(inspect.getmodule(api_).__file__), "static"),
                   static_url_path='/static')
 
-APP.config['QUART_CORS_ALLOW_ORIGIN'] = os.environ.get("CORS_ALLOW_ORIGIN") or ""
-APP.config['QUART_CORS_ALLOW_CREDENTIALS'] = os.environ.get("CORS_ALLOW_CREDENTIALS")
-APP.config['QUART_CORS_ALLOW_METHODS'] = os.environ.get("CORS_ALLOW_METHODS")
-APP.config['QUART_CORS_ALLOW_HEADERS'] = os.environ.get("CORS_ALLOW_HEADERS")
-APP.config['QUART_CORS_EXPOSE_HEADERS'] = os.environ.get("CORS_EXPOSE_HEADERS")
-APP.config['QUART_CORS_MAX_AGE'] = os.environ.get("CORS_MAX_AGE")
+# Collect CORS_* settings from the environment in a single pass
+CORS_ENV = {key.removeprefix("CORS_"): value for key, value in os.environ.items() if key.startswith("CORS_")}
+APP.config['QUART_CORS_ALLOW_ORIGIN'] = CORS_ENV.get("ALLOW_ORIGIN") or ""
+for option in ("ALLOW_CREDENTIALS", "ALLOW_METHODS", "ALLOW_HEADERS", "EXPOSE_HEADERS", "MAX_AGE"):
+    APP.config[f'QUART_CORS_{option}'] = CORS_ENV.get(option)
 
 APP = cors(APP)
 
 APP.url_map.strict_slashes = API_RULES.strict_slashes
 APP.config['JSONIFY_PRETTYPRINT_REGULAR'] = CONFIG['server'].get('pretty_print', False)
+# refuse oversize bodies based on Content-Length, or as soon as a streamed body exceeds the limit
+APP.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
 
 PLUGINS["provider"]["toardb"] = "provider.toardb_csa.ToarDBProvider"
 PLUGINS["provider"]["ElasticSearchConnectedSystems"] = \
@@ -59,6 +60,22 @@ PLUGINS["provider"]["TimescaleDBConnectedSystems"] = \
 
 csapi_ = CSAPI(CONFIG, OPENAPI)
 
+# handlers of sub-resources by (sub-resource, method), with the parameter the parent id is passed as
+SYSTEMS_SUBPATH_HANDLERS = {
+    ("members", "GET"): (csapi_.get_systems, "parent"),
+    ("deployments", "GET"): (csapi_.get_deployments, "system"),
+    ("samplingFeatures", "GET"): (csapi_.get_sampling_features, "system"),
+    ("datastreams", "GET"): (csapi_.get_datastreams, "system"),
+    ("members", "POST"): (csapi_.post_systems, "parent"),
+    ("samplingFeatures", "POST"): (csapi_.post_sampling_feature, "system"),
+    ("datastreams", "POST"): (csapi_.post_datastreams, "system"),
+}
+DATASTREAMS_SUBPATH_HANDLERS = {
+    ("schema", "GET"): (csapi_.get_datastreams_schema, "id"),
+    ("observations", "GET"): (csapi_.get_observations, "datastream"),
+    ("observations", "POST"): (csapi_.post_observations, "datastream"),
+}
+
 
 @APP.route('/')
 async def landing_page():
@@ -163,23 +180,7 @@ async def systems_path(path=None):
 @APP.route('/systems/<path:path>/samplingFeatures', methods=['GET', 'POST'])
 @APP.route('/systems/<path:path>/datastreams', methods=['GET', 'POST'])
 async def systems_subpath(path=None):
-    property = request.path.split('/')[-1]
-    if request.method == 'GET':
-        if property == "members":
-            return await get_response(await csapi_.get_systems(request, ("parent", path)))
-        elif property == "deployments":
-            return await get_response(await csapi_.get_deployments(request, ("system", path)))
-        elif property == "samplingFeatures":
-            return await get_response(await csapi_.get_sampling_features(request, ("system", path)))
-        elif property == "datastreams":
-            return await get_response(await csapi_.get_datastreams(request, ("system", path)))
-    elif request.method == 'POST':
-        if property == "members":
-            return await get_response(await csapi_.post_systems(request, ("parent", path)))
-        elif property == "samplingFeatures":
-            return await get_response(await csapi_.post_sampling_feature(request, ("system", path)))
-        elif property == "datastreams":
-            return await get_response(await csapi_.post_datastreams(request, ("system", path)))
+    return await _dispatch_subpath(SYSTEMS_SUBPATH_HANDLERS, path)
 
 
 @APP.route('/procedures', methods=['GET', 'POST'])
@@ -271,16 +272,7 @@ async def datastreams_path(path=None):
 @APP.route('/datastreams/<path:path>/schema', methods=['GET', 'PUT'])
 @APP.route('/datastreams/<path:path>/observations', methods=['GET', 'POST'])
 async def datastreams_subpath(path=None):
-    property = request.path.split('/')[-1]
-    if request.method == 'GET':
-        if property == "schema":
-            return await get_response(await csapi_.get_datastreams_schema(request, ("id", path)))
-        elif property == "observations":
-            return await get_response(await csapi_.get_observations(request, ("datastream", path)))
-    elif request.method == 'PUT':
-        return await get_response((None, HTTPStatus.NOT_IMPLEMENTED, ""))
-    elif request.method == 'POST':
-        return await get_response(await csapi_.post_observations(request, ("datastream", path)))
+    return await _dispatch_subpath(DATASTREAMS_SUBPATH_HANDLERS, path)
 
 
 @APP.route('/observations', methods=['GET'])
@@ -295,6 +287,14 @@ async def observations_path(path=None):
         return await get_response((None, HTTPStatus.NOT_IMPLEMENTED, ""))
 
 
+async def _dispatch_subpath(handlers: dict, path: str):
+    handler = handlers.get((request.path.rpartition('/')[2], request.method))
+    if handler is None:
+        return await get_response((None, HTTPStatus.NOT_IMPLEMENTED, ""))
+    method, key = handler
+    return await get_response(await method(request, (key, path)))
+
+
 async def get_response(result: tuple):
     """
     Creates a Quart Response object and updates matching headers.
@@ -1,73 +1,147 @@
 import asyncio
+import base64
+import dataclasses
 import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from http import HTTPStatus
 from typing import Coroutine, Any, Union
 
 from elasticsearch import AsyncElasticsearch
-from elasticsearch_dsl import Search
+from elasticsearch.helpers import async_bulk
+from elasticsearch.serializer import OrjsonSerializer
 from elastic_transport import NodeConfig
+import orjson
 
 from .definitions import *
-from pygeoapi.provider.base import ProviderConnectionError, ProviderInvalidDataError, ProviderQueryError
+from pygeoapi.provider.base import ProviderConnectionError, ProviderInvalidDataError, ProviderQueryError, \
+    ProviderInvalidQueryError
 
 LOGGER = logging.getLogger(__name__)
 
+# maximum from + size served by from/size pagination (default index.max_result_window)
+MAX_RESULT_WINDOW = 10_000
+# time a point in time is kept open between two consecutive pages
+PIT_KEEP_ALIVE = "1m"
+# number of actions per bulk request and number of bulk requests sent concurrently for large batches
+BULK_CHUNK_SIZE = 500
+BULK_CONCURRENCY = 4
+# fields matched by the free-text query parameter
+Q_FIELDS = ("name", "description")
+
+
+@dataclass(frozen=True, slots=True)
+class QueryBuilder:
+    """
+    Assembles plain Elasticsearch query bodies, replacing elasticsearch_dsl.Search in the request path.
+    Builders are immutable, every modification returns a new builder.
+    """
+    filters: Tuple[Dict, ...] = ()
+    must_not: Tuple[Dict, ...] = ()
+    extras: Optional[Dict] = None
+
+    def filter(self, name: str, **clause) -> "QueryBuilder":
+        return QueryBuilder(self.filters + ({name: clause},), self.must_not, self.extras)
+
+    def exclude(self, name: str, **clause) -> "QueryBuilder":
+        return QueryBuilder(self.filters, self.must_not + ({name: clause},), self.extras)
+
+    def extra(self, **kwargs) -> "QueryBuilder":
+        return QueryBuilder(self.filters, self.must_not, (self.extras or {}) | kwargs)
+
+    def to_dict(self) -> Dict:
+        body = {}
+        if self.filters or self.must_not:
+            clauses = {}
+            if self.filters:
+                clauses["filter"] = self.filters
+            if self.must_not:
+                clauses["must_not"] = self.must_not
+            body["query"] = {"bool": clauses}
+        if self.extras:
+            body.update(self.extras)
+        return body
+
+
+def _filter_range(query: QueryBuilder, field: str, interval: TimeInterval) -> QueryBuilder:
+    # emit a single range filter covering whichever bounds are set
+    if interval is None:
+        return query
+    start, end = interval
+    bounds = {}
+    if start:
+        bounds["gte"] = start.isoformat()
+    if end:
+        bounds["lte"] = end.isoformat()
+    if bounds:
+        query = query.filter("range", **{field: bounds})
+    return query
+
 
-def parse_datetime_params(query: Search, parameters: DatetimeParam) -> Search:
+def parse_datetime_params(query: QueryBuilder, parameters: DatetimeParam) -> QueryBuilder:
     # Parse dateTime filter
-    if parameters.datetime_start() and parameters.datetime_end():
-        query = query.filter("range", validTime_parsed={"gte": parameters.datetime_start().isoformat(),
-                                                        "lte": parameters.datetime_end().isoformat()})
-    if parameters.datetime_start():
-        query = query.filter("range", validTime_parsed={"gte": parameters.datetime_start().isoformat()})
-    if parameters.datetime_end():
-        query = query.filter("range", validTime_parsed={"lte": parameters.datetime_end().isoformat()})
-    return query
+    return _filter_range(query, "validTime_parsed", parameters._datetime)
 
 
-def parse_csa_params(query: Search, parameters: CSAParams) -> Search:
+def parse_csa_params(query: QueryBuilder, parameters: CSAParams) -> QueryBuilder:
     # Parse id filter
     if parameters.id is not None:
-        query = query.filter("terms", _id=parameters.id)
-    if parameters.q is not None:
-        query = query.query("multi_match", query=parameters.q, fields=["name", "description"])
+        query = query.filter("ids", values=parameters.id)
+    # normalize free text so equivalent queries produce identical (cacheable) clauses.
+    # the matched fields are analyzed, so this does not change the result
+    q = parameters.q.strip().lower() if parameters.q else None
+    if q:
+        # results are not ranked, so match in filter context to skip scoring and allow caching
+        query = query.filter("multi_match", query=q, fields=Q_FIELDS)
     return query
 
 
-def parse_spatial_params(query: Search,
+def parse_spatial_params(query: QueryBuilder,
                          parameters: Union[
-                             DeploymentsParams, SystemsParams, SamplingFeaturesParams, CollectionParams]) -> Search:
+                             DeploymentsParams, SystemsParams, SamplingFeaturesParams, CollectionParams]
+                         ) -> QueryBuilder:
     # Parse bbox filter
     if parameters.bbox is not None:
-        br = f"POINT ({parameters.bbox['y1']} {parameters.bbox['x2']})"
-        tl = f"POINT ({parameters.bbox['x1']} {parameters.bbox['y2']})"
-        query = query.filter("geo_bounding_box", position={"top_left": tl, "bottom_right": br})
+        bbox = parameters.bbox
+        query = query.filter("geo_bounding_box", position={
+            "top_left": {"lon": bbox["x1"], "lat": bbox["y2"]},
+            "bottom_right": {"lon": bbox["y1"], "lat": bbox["x2"]},
+        })
     if parameters.geom is not None:
         query = query.filter("geo_shape", position={"relation": "intersects", "shape": parameters.geom})
     return query
 
 
-def parse_temporal_filters(query, parameters: ObservationsParams | DatastreamsParams) -> Search:
+def parse_temporal_filters(query: QueryBuilder, parameters: ObservationsParams | DatastreamsParams) -> QueryBuilder:
     # Parse resultTime filter
-    if parameters.resulttime_start() and parameters.resulttime_end():
-        query = query.filter("range", validTime_parsed={"gte": parameters.resulttime_start().isoformat(),
-                                                        "lte": parameters.resulttime_end().isoformat()})
-    if parameters.resulttime_start():
-        query = query.filter("range", validTime_parsed={"gte": parameters.resulttime_start().isoformat()})
-    if parameters.resulttime_end():
-        query = query.filter("range", validTime_parsed={"lte": parameters.resulttime_end().isoformat()})
+    query = _filter_range(query, "resultTime_parsed", parameters._resultTime)
 
     # Parse phenomenonTime filter
-    if parameters.phenomenontime_start() and parameters.phenomenontime_end():
-        query = query.filter("range", validTime_parsed={"gte": parameters.phenomenontime_start().isoformat(),
-                                                        "lte": parameters.phenomenontime_end().isoformat()})
-    if parameters.phenomenontime_start():
-        query = query.filter("range", validTime_parsed={"gte": parameters.phenomenontime_start().isoformat()})
-    if parameters.phenomenontime_end():
-        query = query.filter("range", validTime_parsed={"lte": parameters.phenomenontime_end().isoformat()})
+    query = _filter_range(query, "phenomenonTime_parsed", parameters._phenomenonTime)
 
     return query
 
 
+def format_date_range(key: str, item: Dict) -> None:
+    # store the TimePeriod at key as es-compatible date_range in <key>_parsed
+    # values are passed through as given, only "now" is resolved
+    period = item.get(key)
+    if period:
+        start, end = period[0], period[1]
+        if start == "now" or end == "now":
+            now = datetime.utcnow()
+            if start == "now":
+                start = now
+            if end == "now":
+                end = now
+
+        item[key + "_parsed"] = {
+            "gte": start,
+            "lte": end
+        }
+
+
 @dataclass(frozen=True)
 class ElasticSearchConfig:
     hostname: str
@@ -75,9 +149,31 @@ class ElasticSearchConfig:
     user: str
     password: str
     dbname: str
+    verify_certs: bool = False
+    connections_per_node: int = 32
+
+
+# clients shared by all providers of a worker that connect to the same cluster, with their number of users
+_clients: Dict[ElasticSearchConfig, AsyncElasticsearch] = {}
+_client_users: Dict[ElasticSearchConfig, int] = {}
+
+
+def _client_key(config: ElasticSearchConfig) -> ElasticSearchConfig:
+    # the dbname is not used by the client, so providers on different databases still share one pool
+    return dataclasses.replace(config, port=int(config.port), dbname="")
 
 
 async def connect_elasticsearch(config: ElasticSearchConfig) -> AsyncElasticsearch:
+    """
+    Returns the client shared by all users of the cluster described by config.
+    Every call has to be paired with a call to close_elasticsearch() once the client is no longer used.
+    """
+    key = _client_key(config)
+    es = _clients.get(key)
+    if es is not None:
+        _client_users[key] += 1
+        return es
+
     LOGGER.debug(f'Connecting to Elasticsearch at: https://{config.hostname}:{config.port}/{config.dbname}')
     es: AsyncElasticsearch = AsyncElasticsearch(
         [
@@ -85,13 +181,41 @@ async def connect_elasticsearch(config: ElasticSearchConfig) -> AsyncElasticsear
                 scheme="https",
                 host=config.hostname,
                 port=config.port,
-                verify_certs=False,
-                ca_certs=None,
-                ssl_show_warn=False,
+                verify_certs=config.verify_certs,
+                ssl_show_warn=config.verify_certs,
             )
         ],
-        http_auth=(config.user, config.password),
-        verify_certs=False)
+        basic_auth=(config.user, config.password),
+        http_compress=True,
+        node_class="aiohttp",
+        serializer=OrjsonSerializer(),
+        connections_per_node=config.connections_per_node)
+    _clients[key] = es
+    _client_users[key] = 1
+    return es
+
+
+async def close_elasticsearch(config: ElasticSearchConfig) -> None:
+    """
+    Releases one user of the shared client. The client is closed once its last user released it,
+    later calls to connect_elasticsearch() then create a new client.
+    """
+    key = _client_key(config)
+    if key not in _clients:
+        return
+    _client_users[key] -= 1
+    if _client_users[key] > 0:
+        return
+    # remove the client before closing, so concurrent connects do not pick up a closing client
+    es = _clients.pop(key)
+    del _client_users[key]
+    await es.close()
+
+
+async def setup_elasticsearch(es: AsyncElasticsearch,
+                              mappings: List[Tuple[str, Dict]],
+                              settings: Optional[Dict] = None) -> AsyncElasticsearch:
+    # connectivity and version are checked once during setup instead of on every connect
     if not await es.ping():
         msg = f'Cannot connect to Elasticsearch'
         LOGGER.critical(msg)
@@ -99,83 +223,223 @@ async def connect_elasticsearch(config: ElasticSearchConfig) -> AsyncElasticsear
 
     LOGGER.debug('Determining ES version')
     v = await(es.info())
-    v = v['version']['number'][:3]
-    if float(v) < 8:
+    major = int(v['version']['number'].split(".", 1)[0])
+    if major < 8:
         msg = 'only ES 8+ supported'
         LOGGER.critical(msg)
         raise ProviderConnectionError(msg)
-    return es
-
-
-async def setup_elasticsearch(es: AsyncElasticsearch, mappings: List[Tuple[str, Dict]]) -> AsyncElasticsearch:
-    try:
-        for index in mappings:
-            index_name, index_mapping = index
 
-            if not await (es.indices.exists(index=index_name)):
-                await es.indices.create(
-                    index=index_name,
-                    mappings=index_mapping
-                )
-    except Exception as e:
-        LOGGER.exception(e)
+    # check and create all indices concurrently
+    exists = await asyncio.gather(*(es.indices.exists(index=index_name) for index_name, _ in mappings),
+                                  return_exceptions=True)
+    # settings are only applied to newly created indices. mappings of existing indices are updated in place,
+    # so fields added in later versions are mapped before documents containing them are indexed.
+    # documents stored before such an update have to be backfilled separately (see README)
+    results = await asyncio.gather(*(es.indices.create(index=index_name, mappings=index_mapping, settings=settings)
+                                     if not present else
+                                     es.indices.put_mapping(index=index_name, **index_mapping)
+                                     for (index_name, index_mapping), present in zip(mappings, exists)
+                                     if not isinstance(present, Exception) and (not present or index_mapping)),
+                                   return_exceptions=True)
+    for e in (*exists, *results):
+        if isinstance(e, Exception):
+            LOGGER.error(e, exc_info=e)
 
     LOGGER.debug("finished initializing AsyncElasticsearch")
     return es
 
 
+class SearchCache:
+    """
+    Short-lived in-process cache of search responses, keyed on the query body and request parameters.
+    Entries expire after `ttl` seconds or as soon as a write to their index is registered with invalidate().
+    Writes served by other worker processes are only observed once the entries expired.
+    """
+    MISSING = object()
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Tuple, Tuple[float, int, CSAGetResponse]] = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    def get(self, index: str, key: Tuple) -> CSAGetResponse:
+        entry = self._entries.get(key)
+        if entry is None:
+            return self.MISSING
+        expires, generation, response = entry
+        if expires < time.monotonic() or generation != self._generations.get(index, 0):
+            del self._entries[key]
+            return self.MISSING
+        self._entries.move_to_end(key)
+        return response
+
+    def put(self, index: str, key: Tuple, response: CSAGetResponse) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, self._generations.get(index, 0), response)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, index: str) -> None:
+        self._generations[index] = self._generations.get(index, 0) + 1
+
+
+class ExistenceCache:
+    """
+    Bounded cache of (index, id) pairs recently found to exist. Misses are not cached, so new documents are picked
+    up immediately, while removed documents are only noticed once their entry expired after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._expiry: OrderedDict[Tuple[str, str], float] = OrderedDict()
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        expires = self._expiry.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._expiry[key]
+            return False
+        return True
+
+    def add(self, key: Tuple[str, str]) -> None:
+        self._expiry[key] = time.monotonic() + self.ttl
+        self._expiry.move_to_end(key)
+        if len(self._expiry) > self.maxsize:
+            self._expiry.popitem(last=False)
+
+
+def _encode_cursor(pit_id: str, sort: List) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([pit_id, sort])).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, List]:
+    try:
+        pit_id, sort = orjson.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError):
+        raise ProviderInvalidQueryError(user_msg="invalid cursor")
+    return pit_id, sort
+
+
 async def search(es: AsyncElasticsearch,
                  index: str,
                  body: Dict,
                  parameters: CSAParams,
-                 excludes=None) -> CSAGetResponse:
-    # Select appropriate strategy here: For collections >10k elements search_after must be used
-    if excludes is None:
-        excludes = []
-    found = (await es.search(body=body,
-                             index=index,
-                             size=parameters.limit,
-                             from_=parameters.offset,
-                             source_excludes=excludes))["hits"]
-
-    count = found["total"]["value"]
-    if count > 0:
-        links = []
+                 excludes: Tuple[str, ...] = (),
+                 includes: Tuple[str, ...] = (),
+                 cache: Optional[SearchCache] = None) -> CSAGetResponse:
+    limit = int(parameters.limit)
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug(orjson.dumps(body, default=str, option=orjson.OPT_INDENT_2).decode())
+
+    shallow = parameters.cursor is None and parameters.offset + 2 * limit <= MAX_RESULT_WINDOW
+    key = None
+    if cache is not None and shallow:
+        # pages served from a point in time are not cached, their cursors expire with the pit
+        key = (index, orjson.dumps(body, default=str), excludes, includes, parameters.nextlink())
+        response = cache.get(index, key)
+        if response is not SearchCache.MISSING:
+            return response
+
+    if shallow:
+        # shallow pages (including the following one) are served by from/size.
+        # repeated pages are answered from the shard request cache until the next refresh
+        request = dict(body)
+        request["size"] = limit
+        request["from"] = parameters.offset
+        request["track_total_hits"] = False
+        hits = (await es.search(body=request,
+                                index=index,
+                                request_cache=True,
+                                source_excludes=excludes,
+                                source_includes=includes))["hits"]["hits"]
+        nextlink = parameters.nextlink() if len(hits) == limit else None
+    else:
+        # deeper pages are served from a point in time using search_after, as from/size is capped by ES
+        if parameters.cursor is not None:
+            pit_id, search_after = _decode_cursor(parameters.cursor)
+            offset = None
+        elif parameters.offset + limit <= MAX_RESULT_WINDOW:
+            pit_id = (await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+            search_after, offset = None, parameters.offset
+        else:
+            raise ProviderInvalidQueryError(
+                user_msg=f"offset + limit must not exceed {MAX_RESULT_WINDOW}, use the cursor of the next link")
+
+        # build a separate request body, so the caller's body is left untouched and unset fields are not sent
+        request = dict(body)
+        request["size"] = limit
+        request["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+        request["sort"] = ["_shard_doc"]
+        request["track_total_hits"] = False
+        if offset is not None:
+            request["from"] = offset
+        if search_after is not None:
+            request["search_after"] = search_after
+
+        response = await es.search(body=request,
+                                   source_excludes=excludes,
+                                   source_includes=includes)
+        hits = response["hits"]["hits"]
+        pit_id = response.get("pit_id", pit_id)
+        if len(hits) == limit:
+            nextlink = parameters.nextlink(_encode_cursor(pit_id, hits[-1]["sort"]))
+        else:
+            await es.close_point_in_time(id=pit_id)
+            nextlink = None
 
-        if count == int(parameters.limit):
+    if len(hits) > 0:
+        links = []
+        if nextlink is not None:
             links.append({
                 "title": "next",
                 "rel": "next",
-                "href": parameters.nextlink()
+                "href": nextlink
             })
 
-        return [h["_source"] for h in found["hits"]], links
-    else:
-
+        response = [h["_source"] for h in hits], links
+    elif parameters.id:
         # check if this query returns 404 or 200 with empty body in case of no return
-        if parameters.id:
-            return None
-        else:
-            return [], []
-
-
-async def create_many(es: AsyncElasticsearch, index: str, items: List[Tuple[str, Dict]]) -> CSACrudResponse:
-    routines = [None] * len(items)
-
-    for i, elem in enumerate(items):
-        identifier, item = elem
-        # add to ES if not already present
-        exists = await es.exists(index=index, id=identifier)
-        if exists.body:
-            # TODO: what should happen here?
+        response = None
+    else:
+        response = [], []
+
+    if key is not None:
+        cache.put(index, key, response)
+    return response
+
+
+async def create_many(es: AsyncElasticsearch,
+                      index: str,
+                      items: List[Tuple[str, Dict]],
+                      cache: Optional[SearchCache] = None) -> CSACrudResponse:
+    # create all items in bulk requests. "create" actions are rejected by ES if the id is already present.
+    # large batches are split into chunks, which are indexed concurrently
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def _bulk(chunk: List[Tuple[str, Dict]]) -> List[Dict]:
+        actions = ({"_op_type": "create", "_index": index, "_id": identifier, "_source": item}
+                   for identifier, item in chunk)
+        async with semaphore:
+            _, failed = await async_bulk(es, actions, raise_on_error=False, chunk_size=BULK_CHUNK_SIZE)
+        return failed
+
+    results = await asyncio.gather(*(_bulk(items[i:i + BULK_CHUNK_SIZE])
+                                     for i in range(0, len(items), BULK_CHUNK_SIZE)))
+    errors = [error for failed in results for error in failed]
+    if cache is not None:
+        # also invalidate on errors, as parts of the batch may have been written
+        cache.invalidate(index)
+
+    if errors:
+        if any(error["create"]["status"] == HTTPStatus.CONFLICT for error in errors):
             msg = 'record already exists'
-            LOGGER.error(msg)
-            raise ProviderInvalidDataError(msg)
         else:
-            routines[i] = es.index(index=index, id=identifier, document=item)
-
-    # wait for completion
-    await asyncio.gather(*routines)
+            msg = f'could not create records: {errors}'
+        LOGGER.error(msg)
+        raise ProviderInvalidDataError(msg)
 
     # TODO: check if we need to validate something here
     return [item[0] for item in items]
@@ -14,6 +14,7 @@
 # limitations under the License.
 # =================================================================
 import dataclasses
+import functools
 import urllib.parse
 from dataclasses import dataclass
 from typing import List, Optional, Dict, Tuple, TypeAlias
@@ -49,13 +50,15 @@ FORMAT_TYPES = OrderedDict((
 
 @dataclass
 class CSAParams:
-    _parameters = ["f", "id", "q", "limit", "offset"]
+    __slots__ = ()  # fields are slotted by the concrete parameter classes
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor"]
     _url: str = None
     f: str = None  # format
     id: List[str] = None
     q: Optional[List[str]] = None
     limit: int = 10
     offset: int = 0  # non-standard
+    cursor: Optional[str] = None  # non-standard, continuation token for deep pagination
 
     @property
     def format(self):
@@ -65,9 +68,27 @@ class CSAParams:
     def format(self, inp):
         self.f = inp
 
-    def nextlink(self) -> str:
-        values = {k: v for k, v in dataclasses.asdict(self).items() if v is not None and not k.startswith("_")}
-        values["offset"] += values["limit"]
+    def nextlink(self, cursor: Optional[str] = None) -> str:
+        values = {}
+        # read fields directly, dataclasses.asdict deep-copies every value
+        for field in dataclasses.fields(self):
+            name = field.name
+            value = getattr(self, name)
+            if value is None or name.startswith("_"):
+                continue
+            if isinstance(value, list):
+                value = ",".join(value)
+            elif isinstance(value, dict):
+                # bbox, serialized in its original axis order
+                value = ",".join(str(v) for k, v in value.items() if k != "type")
+            values[name] = value
+
+        if cursor is not None:
+            # continuation token replaces the offset
+            values.pop("offset", None)
+            values["cursor"] = cursor
+        else:
+            values["offset"] += values["limit"]
         return (self._url
                 + "?"
                 + urllib.parse.urlencode(values))
@@ -75,16 +96,19 @@ class CSAParams:
 
 @dataclass
 class BBoxParam:
+    __slots__ = ()
     bbox: Optional[Dict] = None
 
 
 @dataclass
 class GeomParam:
+    __slots__ = ()
     geom: Optional[str] = None
 
 
 @dataclass
 class ResulttimePhenomenontimeParam(CSAParams):
+    __slots__ = ()
     phenomenonTime: str = None  # unparsed original value
     resultTime: str = None  # unparsed original value
 
@@ -106,6 +130,7 @@ class ResulttimePhenomenontimeParam(CSAParams):
 
 @dataclass
 class DatetimeParam(CSAParams):
+    __slots__ = ()
     datetime: str = None  # unparsed original value
     _datetime: TimeInterval = None
 
@@ -118,20 +143,21 @@ class DatetimeParam(CSAParams):
 
 @dataclass
 class FoiObservedpropertyParam(CSAParams):
+    __slots__ = ()
     foi: Optional[List[str]] = None
     observedProperty: Optional[List[str]] = None
 
 
 @dataclass(slots=True)
 class CollectionParams(DatetimeParam, FoiObservedpropertyParam, CSAParams, BBoxParam, GeomParam):
-    _parameters = ["f", "id", "q", "limit", "offset", "foi", "observedProperty", "bbox", "geom"]
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor", "foi", "observedProperty", "bbox", "geom"]
     pass
 
 
 @dataclass(slots=True)
 class SystemsParams(DatetimeParam, FoiObservedpropertyParam, BBoxParam, GeomParam):
-    _parameters = ["f", "id", "q", "limit", "offset", "bbox", "foi", "observedProperty", "parent", "procedure",
-                   "controlledProperty", "geom"]
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor", "bbox", "foi", "observedProperty", "parent",
+                   "procedure", "controlledProperty", "geom"]
     parent: Optional[List[str]] = None
     procedure: Optional[List[str]] = None
     controlledProperty: Optional[List[str]] = None
@@ -139,27 +165,32 @@ class SystemsParams(DatetimeParam, FoiObservedpropertyParam, BBoxParam, GeomPara
 
 @dataclass(slots=True)
 class DeploymentsParams(DatetimeParam, FoiObservedpropertyParam, BBoxParam, GeomParam):
-    _parameters = ["f", "id", "q", "limit", "offset", "bbox", "foi", "observedProperty", "system", "geom"]
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor", "bbox", "foi", "observedProperty", "system", "geom"]
     system: Optional[List[str]] = None
 
 
 @dataclass(slots=True)
 class ProceduresParams(DatetimeParam, FoiObservedpropertyParam):
-    _parameters = ["f", "id", "q", "limit", "offset", "foi", "observedProperty", "controlledProperty"]
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor", "foi", "observedProperty", "controlledProperty"]
     controlledProperty: Optional[List[str]] = None
 
 
 @dataclass(slots=True)
 class SamplingFeaturesParams(DatetimeParam, FoiObservedpropertyParam, BBoxParam, GeomParam):
-    _parameters = ["f", "id", "q", "limit", "offset", "bbox", "foi", "observedProperty", "controlledProperty", "system",
-                   "geom"]
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor", "bbox", "foi", "observedProperty",
+                   "controlledProperty", "system", "geom"]
     controlledProperty: Optional[List[str]] = None
     system: Optional[List[str]] = None
 
 
+@dataclass(slots=True)
+class PropertiesParams(CSAParams):
+    pass
+
+
 @dataclass(slots=True)
 class DatastreamsParams(FoiObservedpropertyParam, ResulttimePhenomenontimeParam):
-    _parameters = ["f", "id", "q", "limit", "offset", "foi", "observedProperty", "system", "phenomenonTime",
+    _parameters = ["f", "id", "q", "limit", "offset", "cursor", "foi", "observedProperty", "system", "phenomenonTime",
                    "resultTime"]
     system: Optional[List[str]] = None
     schema: Optional[bool] = None
@@ -315,121 +346,116 @@ class ConnectedSystemsPart1Provider(ConnectedSystemsProvider):
         raise NotImplementedError()
 
 
-def parse_query_parameters(out_parameters: CSAParams, input_parameters: Dict, url: str):
+def _parse_list(out_parameters: CSAParams, key: str, raw: str):
+    setattr(out_parameters, key, raw.split(","))
+
+
+def _verbatim(out_parameters: CSAParams, key: str, raw: str):
+    setattr(out_parameters, key, raw)
+
+
+def _parse_int(out_parameters: CSAParams, key: str, raw: str):
+    setattr(out_parameters, key, int(raw))
+
+
+def _parse_bbox(out_parameters: CSAParams, key: str, raw: str):
+    split = [float(coordinate) for coordinate in raw.split(',')]
+    if len(split) == 4:
+        box = {
+            "type": "2d",
+            "x1": split[0],  # Lower left corner, coordinate axis 1
+            "x2": split[1],  # Lower left corner, coordinate axis 2
+            "y1": split[2],  # Upper right corner, coordinate axis 1
+            "y2": split[3]  # Upper right corner, coordinate axis 2
+        }
+    elif len(split) == 6:
+        box = {
+            "type": "3d",
+            "x1": split[0],  # Lower left corner, coordinate axis 1
+            "x2": split[1],  # Lower left corner, coordinate axis 2
+            "xalt": split[2],  # Minimum value, coordinate axis 3 (optional)
+            "y1": split[3],  # Upper right corner, coordinate axis 1
+            "y2": split[4],  # Upper right corner, coordinate axis 2
+            "yalt": split[5]  # Maximum value, coordinate axis 3 (optional)
+        }
+    else:
+        raise ProviderInvalidQueryError("invalid bbox")
+    setattr(out_parameters, "bbox", box)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_timestamp(raw: str) -> datetime:
+    # paginating clients repeat the same time filters, datetimes are immutable and safe to share
+    return datetime.fromisoformat(raw)
+
+
+def _parse_instant(raw: str, now: Optional[datetime]) -> Optional[datetime]:
+    # TODO: check if more edge cases/predefined variables exist
+    if raw == "now":
+        return now
+    elif raw == "..":
+        return None
+    return _parse_timestamp(raw)
+
+
+def _parse_time_interval(out_parameters: CSAParams, key: str, raw: str):
+    setattr(out_parameters, key, raw)
+    # TODO: Support 'latest' qualifier
+    # all occurrences of "now" in a value refer to the same instant
+    now = datetime.utcnow() if "now" in raw else None
+    if "/" in raw:
+        # time interval
+        split = raw.split("/")
+        start = _parse_instant(split[0], now)
+        end = _parse_instant(split[1], now)
+    else:
+        start = end = _parse_instant(raw, now)
+    setattr(out_parameters, "_" + key, (start, end))
+
+
+# parse functions of all known query parameters, called with (out_parameters, key, raw value)
+_PARSERS = {
+    "id": _parse_list,
+    "system": _parse_list,
+    "parent": _parse_list,
+    "q": _verbatim,
+    "observedProperty": _parse_list,
+    "procedure": _parse_list,
+    "controlledProperty": _parse_list,
+    "foi": _parse_list,
+    "format": _verbatim,
+    "f": _verbatim,
+    "limit": _parse_int,
+    "offset": _parse_int,
+    "cursor": _verbatim,
+    "bbox": _parse_bbox,
+    "datetime": _parse_time_interval,
+    "geom": _verbatim,
+    "datastream": _verbatim,
+    "phenomenonTime": _parse_time_interval,
+    "resultTime": _parse_time_interval,
+}
+
+
+def parse_query_parameters(out_parameters: CSAParams,
+                           input_parameters: Dict,
+                           url: str,
+                           path_parameters: Optional[Dict[str, str]] = None):
     """
-    Parse parameter dict into usable/typed parameters
+    Parse parameter dict into usable/typed parameters.
+    Parameters taken from the request path are passed separately via path_parameters and take precedence.
     """
 
-    def _parse_list(identifier):
-        setattr(out_parameters,
-                identifier,
-                [elem for elem in input_parameters.get(identifier).split(",")])
-
-    def _verbatim(key):
-        setattr(out_parameters, key, input_parameters.get(key))
-
-    def _parse_int(key):
-        setattr(out_parameters, key, int(input_parameters.get(key)))
-
-    def _parse_time(key):
-        val = input_parameters.get(key)
-        if "/" in val:
-            _parse_time_interval(key)
-        else:
-            # TODO: check if more edge cases/predefined variables exist
-            if val == "now":
-                date = datetime.utcnow()
-            else:
-                date = datetime.fromisoformat(val)
-            setattr(out_parameters, key, (date, date))
-
-    def _parse_bbox(key):
-        split = input_parameters.get("bbox").split(',')
-        if len(split) == 4:
-            box = {
-                "type": "2d",
-                "x1": split[0],  # Lower left corner, coordinate axis 1
-                "x2": split[1],  # Lower left corner, coordinate axis 2
-                "y1": split[2],  # Upper right corner, coordinate axis 1
-                "y2": split[3]  # Upper right corner, coordinate axis 2
-            }
-        elif len(split) == 6:
-            box = {
-                "type": "3d",
-                "x1": split[0],  # Lower left corner, coordinate axis 1
-                "x2": split[1],  # Lower left corner, coordinate axis 2
-                "xalt": split[2],  # Minimum value, coordinate axis 3 (optional)
-                "y1": split[3],  # Upper right corner, coordinate axis 1
-                "y2": split[4],  # Upper right corner, coordinate axis 2
-                "yalt": split[5]  # Maximum value, coordinate axis 3 (optional)
-            }
-        else:
-            raise ProviderInvalidQueryError("invalid bbox")
-        setattr(out_parameters, "bbox", box)
-
-    def _parse_time_interval(key):
-        raw = input_parameters.get(key)
-        setattr(out_parameters, key, raw)
-        # TODO: Support 'latest' qualifier
-        now = datetime.utcnow()
-        start, end = None, None
-        if "/" in raw:
-            # time interval
-            split = raw.split("/")
-            startts = split[0]
-            endts = split[1]
-            if startts == "now":
-                start = now
-            elif startts == "..":
-                start = None
-            else:
-                start = datetime.fromisoformat(startts)
-            if endts == "now":
-                end = now
-            elif endts == "..":
-                end = None
-            else:
-                end = datetime.fromisoformat(endts)
-        else:
-            if raw == "now":
-                start = now
-                end = now
-            else:
-                ts = datetime.fromisoformat(raw)
-                start = ts
-                end = ts
-        setattr(out_parameters, "_" + key, (start, end))
-
-    parser = {
-        "id": _parse_list,
-        "system": _parse_list,
-        "parent": _parse_list,
-        "q": _verbatim,
-        "observedProperty": _parse_list,
-        "procedure": _parse_list,
-        "controlledProperty": _parse_list,
-        "foi": _parse_list,
-        "format": _verbatim,
-        "f": _verbatim,
-        "limit": _parse_int,
-        "offset": _parse_int,
-        "bbox": _parse_bbox,
-        "datetime": _parse_time,
-        "geom": _verbatim,
-        "datastream": _verbatim,
-        "phenomenonTime": _parse_time_interval,
-        "resultTime": _parse_time_interval,
-    }
-
     out_parameters._url = url
-    #  TODO: There must be a way to make this more efficient/straightforward..
     # Iterate possible parameters
     try:
         for p in out_parameters._parameters:
             # Check if parameter is supplied as input
-            if p in input_parameters:
+            if path_parameters and p in path_parameters:
+                _PARSERS[p](out_parameters, p, path_parameters[p])
+            elif p in input_parameters:
                 # Parse value with appropriate mapping function
-                parser[p](p)
+                _PARSERS[p](out_parameters, p, input_parameters[p])
 
         return out_parameters
     except Exception as ex:
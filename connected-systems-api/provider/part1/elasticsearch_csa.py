@@ -14,14 +14,11 @@
 # limitations under the License.
 # =================================================================
 import asyncio
-import datetime
-import json
 import logging
 import uuid
 from typing import Dict, List, Union, Coroutine, Tuple
 
 from elasticsearch import AsyncElasticsearch
-from elasticsearch_dsl import Search
 
 from pygeoapi.provider.base import ProviderConnectionError, ProviderQueryError, ProviderInvalidDataError, \
     ProviderGenericError
@@ -29,8 +26,9 @@ from pygeoapi.provider.base import ProviderConnectionError, ProviderQueryError,
 from ..definitions import ConnectedSystemsPart1Provider, CSACrudResponse, SystemsParams, \
     CSAGetResponse, DeploymentsParams, ProceduresParams, SamplingFeaturesParams, CSAParams, CollectionParams
 
-from ..connector_elastic import connect_elasticsearch, ElasticSearchConfig, parse_csa_params, parse_spatial_params, \
-    parse_datetime_params, create_many, search, setup_elasticsearch
+from ..connector_elastic import QueryBuilder, connect_elasticsearch, close_elasticsearch, ElasticSearchConfig, \
+    parse_csa_params, parse_spatial_params, parse_datetime_params, create_many, search, setup_elasticsearch, \
+    format_date_range, SearchCache
 
 LOGGER = logging.getLogger(__name__)
 
@@ -45,6 +43,27 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
     samplingfeatures_index_name = "sampling_features"
     properties_index_name = "properties"
 
+    # indices holding the items of the mandatory collections
+    collection_items_indices = {
+        "all_systems": systems_index_name,
+        "all_procedures": procedures_index_name,
+        "all_fois": samplingfeatures_index_name,
+    }
+
+    # target indices of the entity types accepted by create
+    create_indices = {
+        "system": systems_index_name,
+        "deployment": deployments_index_name,
+        "procedure": procedures_index_name,
+        "samplingFeature": samplingfeatures_index_name,
+        "property": properties_index_name,
+    }
+
+    # internal fields that are not part of system responses
+    systems_source_excludes = ("validTime_parsed",)
+    # optional system parameters that are matched as terms filters
+    systems_terms_filters = ("procedure", "foi", "observedProperty", "controlledProperty")
+
     # TODO: check if there are further problematic fields
     common_mappings = {
         "properties": {
@@ -105,8 +124,15 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
             port=int(provider_def['port']),
             dbname=provider_def['dbname'],
             user=provider_def['user'],
-            password=provider_def['password']
+            password=provider_def['password'],
+            verify_certs=provider_def.get('verify_certs', False),
+            connections_per_node=int(provider_def.get('connections_per_node', 32))
         )
+        # responses are only cached if explicitly enabled, as other workers do not observe invalidations
+        cache_ttl = float(provider_def.get('cache_ttl', 0))
+        self._cache = SearchCache(cache_ttl) if cache_ttl > 0 else None
+        # optional settings for newly created indices, e.g. translog durability or refresh interval
+        self._index_settings = provider_def.get('index_settings')
 
     def get_conformance(self) -> List[str]:
         # TODO: check which of these we actually support
@@ -146,11 +172,12 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
                                     self.properties_mappings),
                                    (self.samplingfeatures_index_name,
                                     self.samplingfeatures_mappings),
-                                   ])
+                                   ],
+                                  self._index_settings)
         await self.__create_mandatory_collections()
 
     async def close(self):
-        await self._es.close()
+        await close_elasticsearch(self._es_config)
 
     async def __create_mandatory_collections(self):
         # Create mandatory collections if not exists
@@ -294,53 +321,54 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
             }
         ]
 
+        # check all mandatory collections in a single round trip.
+        # only existence is relevant, so stop at the first match and skip fetching documents
+        searches = []
         for coll in mandatory:
-            query = Search(using=self._es, index=self.collections_index_name)
+            query = QueryBuilder()
             query = query.filter("term", id=coll["id"])
-            result = (await self._es.search(index=self.collections_index_name, body=query.to_dict()))["hits"]
-            if len(result["hits"]) == 0:
+            searches.append({"index": self.collections_index_name})
+            searches.append(query.extra(size=0, terminate_after=1).to_dict())
+        responses = (await self._es.msearch(searches=searches))["responses"]
+
+        for coll, result in zip(mandatory, responses):
+            if result["hits"]["total"]["value"] == 0:
+                LOGGER.info(f"creating mandatory collection {coll['id']}")
                 await self._es.index(index=self.collections_index_name,
                                      id=coll["id"],
                                      document=coll,
                                      refresh=True)
-            LOGGER.critical(f"creating mandatory collection {coll['id']}")
 
     async def query_collections(self, parameters: CollectionParams) -> Dict[str, Dict]:
-        query = Search(using=self._es, index=self.collections_index_name)
+        query = QueryBuilder()
 
         query = parse_csa_params(query, parameters)
         query = parse_spatial_params(query, parameters)
 
         found = (await self._es.search(index=self.collections_index_name,
-                                       body=query.to_dict()))["hits"]
+                                       body=query.to_dict(),
+                                       track_total_hits=False))["hits"]
         collections = {}
-        if found["total"]["value"] > 0:
-            for h in found["hits"]:
-                collections[h["_source"]["id"]] = h["_source"]
+        for h in found["hits"]:
+            collections[h["_source"]["id"]] = h["_source"]
         return collections
 
     async def query_collection_items(self, collection_id: str, parameters: CSAParams) -> CSAGetResponse:
         # TODO: implement this for non-mandatory collections
-        if collection_id == "all_systems":
-            index = self.systems_index_name
-        elif collection_id == "all_procedures":
-            index = self.procedures_index_name
-        elif collection_id == "all_fois":
-            index = self.samplingfeatures_index_name
-        else:
+        index = self.collection_items_indices.get(collection_id)
+        if index is None:
             # TODO: maybe throw an error here?
             return [], []
 
-        query = Search(using=self._es, index=index)
+        query = QueryBuilder()
 
         if parameters.id:
-            query = query.filter("terms", _id=parameters.id)
+            query = query.filter("ids", values=parameters.id)
 
-        LOGGER.debug(json.dumps(query.to_dict(), indent=True, default=str))
-        return await search(self._es, index, query.to_dict(), parameters)
+        return await search(self._es, index, query.to_dict(), parameters, cache=self._cache)
 
     async def query_systems(self, parameters: SystemsParams) -> CSAGetResponse:
-        query = Search(using=self._es, index=self.systems_index_name)
+        query = QueryBuilder()
 
         query = parse_datetime_params(query, parameters)
         query = parse_csa_params(query, parameters)
@@ -356,17 +384,16 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
         else:
             query = query.exclude("exists", field="parent")
 
-        for key in ["procedure", "foi", "observedProperty", "controlledProperty"]:
-            prop = parameters.__getattribute__(key)
+        for key in self.systems_terms_filters:
+            prop = getattr(parameters, key)
             if prop is not None:
                 query = query.filter("terms", **{key: prop})
 
-        # DEBUG only
-        LOGGER.debug(json.dumps(query.to_dict(), indent=True, default=str))
-        return await search(self._es, self.systems_index_name, query.to_dict(), parameters, ["validTime_parsed"])
+        return await search(self._es, self.systems_index_name, query.to_dict(), parameters,
+                            self.systems_source_excludes, cache=self._cache)
 
     async def query_deployments(self, parameters: DeploymentsParams) -> CSAGetResponse:
-        query = Search(using=self._es, index=self.deployments_index_name)
+        query = QueryBuilder()
 
         query = parse_datetime_params(query, parameters)
         query = parse_csa_params(query, parameters)
@@ -375,11 +402,10 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
         if parameters.system is not None:
             query = query.filter("terms", system=parameters.system)
 
-        LOGGER.debug(json.dumps(query.to_dict(), indent=True, default=str))
-        return await search(self._es, self.deployments_index_name, query.to_dict(), parameters)
+        return await search(self._es, self.deployments_index_name, query.to_dict(), parameters, cache=self._cache)
 
     async def query_procedures(self, parameters: ProceduresParams) -> CSAGetResponse:
-        query = Search(using=self._es, index=self.procedures_index_name)
+        query = QueryBuilder()
 
         query = parse_datetime_params(query, parameters)
         query = parse_csa_params(query, parameters)
@@ -388,11 +414,10 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
             # TODO: check if this is the correct property
             query = query.filter("terms", controlledProperty=parameters.controlledProperty)
 
-        json.dumps(query.to_dict(), indent=True, default=str)
-        return await search(self._es, self.procedures_index_name, query.to_dict(), parameters)
+        return await search(self._es, self.procedures_index_name, query.to_dict(), parameters, cache=self._cache)
 
     async def query_sampling_features(self, parameters: SamplingFeaturesParams) -> CSAGetResponse:
-        query = Search(using=self._es, index=self.samplingfeatures_index_name)
+        query = QueryBuilder()
 
         query = parse_datetime_params(query, parameters)
         query = parse_csa_params(query, parameters)
@@ -404,35 +429,25 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
         if parameters.system is not None:
             query = query.filter("terms", system=parameters.system)
 
-        LOGGER.debug(json.dumps(query.to_dict(), indent=True, default=str))
-        return await search(self._es, self.samplingfeatures_index_name, query.to_dict(), parameters)
+        return await search(self._es, self.samplingfeatures_index_name, query.to_dict(), parameters, cache=self._cache)
 
     async def query_properties(self, parameters: CSAParams) -> CSAGetResponse:
-        query = Search(using=self._es, index=self.properties_index_name)
+        query = QueryBuilder()
 
         query = parse_csa_params(query, parameters)
 
-        LOGGER.debug(json.dumps(query.to_dict(), indent=True, default=str))
-        return await search(self._es, self.properties_index_name, query.to_dict(), parameters)
+        return await search(self._es, self.properties_index_name, query.to_dict(), parameters, cache=self._cache)
 
     async def create(self, type: str, items: List[Dict]) -> CSACrudResponse:
-        routines: List[Tuple[str, Dict]] = [None] * len(items)
+        index_name = self.create_indices.get(type)
+        if index_name is None:
+            raise ProviderGenericError(f"unrecognized type: {type}")
 
-        for i, item in enumerate(items):
+        routines: List[Tuple[str, Dict]] = []
+        for item in items:
             if type == "system":
                 # parse date_range fields to es-compatible format
-                self._format_date_range("validTime", item)
-                index_name = self.systems_index_name
-            elif type == "deployment":
-                index_name = self.deployments_index_name
-            elif type == "procedure":
-                index_name = self.procedures_index_name
-            elif type == "samplingFeature":
-                index_name = self.samplingfeatures_index_name
-            elif type == "property":
-                index_name = self.properties_index_name
-            else:
-                raise ProviderGenericError(f"unrecognized type: {type}")
+                format_date_range("validTime", item)
 
             if "id" not in item:
                 # We may have to generate id as it is not always required
@@ -441,24 +456,6 @@ class ConnectedSystemsESProvider(ConnectedSystemsPart1Provider):
             else:
                 identifier = item["id"]
 
-            routines[i] = (identifier, item)
-
-        return await create_many(self._es, index_name, routines)
-
-    def _format_date_range(self, key: str, item: Dict) -> None:
-        if item.get(key):
-            time = item.get(key)
-            now = datetime.datetime.utcnow()
-            if time[0] == "now":
-                start = now
-            else:
-                start = time[0]
-            if time[1] == "now":
-                end = now
-            else:
-                end = time[1]
+            routines.append((identifier, item))
 
-            item[key + "_parsed"] = {
-                "gte": start,
-                "lte": end
-            }
+        return await create_many(self._es, index_name, routines, self._cache)
@@ -13,7 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # =================================================================
-import json
 import logging
 import numbers
 from datetime import timedelta
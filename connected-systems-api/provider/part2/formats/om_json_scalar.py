@@ -1,10 +1,9 @@
-import json
-import uuid
 from datetime import datetime
 
 import asyncpg
+import orjson
 
-from ..util import SchemaParser, Observation
+from ..util import SchemaParser, Observation, uuid7
 
 schema = {
     "obsFormat": "application/om+json",
@@ -56,12 +55,14 @@ class OMJsonSchemaParser(SchemaParser):
     # Example:
 
     def decode(self, datastream: str, data: any) -> Observation:
+        # phenomenonTime is not part of this schema and mirrors the resultTime
+        result_time = datetime.fromisoformat(data["resultTime"])
         return Observation(
-            id=str(uuid.uuid4()),
+            id=str(uuid7()),
             datastream=datastream,
-            result=json.dumps(data["result"]),
-            resultTime=datetime.fromisoformat(data["resultTime"]),
-            phenomenonTime=datetime.fromisoformat(data["resultTime"]),
+            result=orjson.dumps(data["result"]).decode(),
+            resultTime=result_time,
+            phenomenonTime=result_time,
         )
 
     def encode(self, obs: asyncpg.Record) -> any:
@@ -71,5 +72,6 @@ class OMJsonSchemaParser(SchemaParser):
             "datastream@id": str(obs["datastream"]),
             "resultTime": obs["resulttime"],
             "phenomenonTime": obs["phenomenontime"],
-            "result": json.loads(obs["result"])
+            # the result is stored as json already and passed through to the response without decoding
+            "result": orjson.Fragment(obs["result"])
         }
@@ -1,24 +1,34 @@
-import json
 import logging
 import uuid
+from datetime import datetime, timezone
 from typing import List, Dict, Tuple
 
 import asyncpg
 from asyncpg import Connection
 from elasticsearch import AsyncElasticsearch
-from elasticsearch_dsl import Search
-from pygeoapi.provider.base import ProviderGenericError, ProviderItemNotFoundError
+from pygeoapi.provider.base import ProviderGenericError, ProviderItemNotFoundError, ProviderInvalidDataError
 
 from .formats.om_json_scalar import OMJsonSchemaParser
 from .util import TimescaleDbConfig, ObservationQuery, Observation
-from ..connector_elastic import create_many, connect_elasticsearch, ElasticSearchConfig, search, parse_csa_params, \
-    parse_temporal_filters, setup_elasticsearch
+from ..connector_elastic import QueryBuilder, create_many, connect_elasticsearch, close_elasticsearch, \
+    ElasticSearchConfig, search, parse_csa_params, parse_temporal_filters, setup_elasticsearch, format_date_range, \
+    SearchCache, ExistenceCache
 from ..definitions import ConnectedSystemsPart2Provider, CSAGetResponse, DatastreamsParams, ObservationsParams, \
     CSACrudResponse
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _result_time_key(obs: Observation) -> datetime:
+    # batches may mix offset-aware and naive timestamps, which are not comparable, so naive values are ordered as UTC
+    result_time = obs.resultTime
+    if result_time is None:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    if result_time.tzinfo is None:
+        return result_time.replace(tzinfo=timezone.utc)
+    return result_time
+
+
 class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
     _pool: asyncpg.connection = None
     _es: AsyncElasticsearch = None
@@ -32,10 +42,19 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
             },
             "id": {
                 "type": "keyword"
+            },
+            "phenomenonTime_parsed": {
+                "type": "date_range"
+            },
+            "resultTime_parsed": {
+                "type": "date_range"
             }
         }
     }
 
+    # internal fields that are not part of datastream responses
+    datastreams_source_excludes = ("phenomenonTime_parsed", "resultTime_parsed")
+
     def __init__(self, provider_def):
         super().__init__(provider_def)
         self.base_url = provider_def["base_url"]
@@ -45,6 +64,8 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
             user=provider_def["timescale"]["user"],
             password=provider_def["timescale"]["password"],
             dbname=provider_def["timescale"]["dbname"],
+            pool_min_size=int(provider_def["timescale"].get("pool_min_size", 10)),
+            pool_max_size=int(provider_def["timescale"].get("pool_max_size", 10)),
         )
 
         self._es_config = ElasticSearchConfig(
@@ -53,13 +74,25 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
             user=provider_def["elastic"]["user"],
             password=provider_def["elastic"]["password"],
             dbname=provider_def["elastic"]["dbname"],
+            verify_certs=provider_def["elastic"].get("verify_certs", False),
+            connections_per_node=int(provider_def["elastic"].get("connections_per_node", 32)),
         )
+        # responses are only cached if explicitly enabled, as other workers do not observe invalidations
+        cache_ttl = float(provider_def["elastic"].get("cache_ttl", 0))
+        self._cache = SearchCache(cache_ttl) if cache_ttl > 0 else None
+        # optional settings for newly created indices, e.g. translog durability or refresh interval
+        self._index_settings = provider_def["elastic"].get("index_settings")
+        # linked entities recently verified to exist, repeated creates for them skip the lookup
+        self._known = ExistenceCache()
         self.parser = OMJsonSchemaParser()
 
     async def open(self):
+        # queries are small and frequent, so JIT compilation would cost more than it saves
         self._pool = await asyncpg.create_pool(self._ts_config.connection_string(),
                                                min_size=self._ts_config.pool_min_size,
-                                               max_size=self._ts_config.pool_max_size)
+                                               max_size=self._ts_config.pool_max_size,
+                                               server_settings={"jit": "off",
+                                                                "application_name": "connected-systems-api"})
 
         self._es: AsyncElasticsearch = await connect_elasticsearch(self._es_config)
 
@@ -90,6 +123,38 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
                                     );
                                     """)
 
+        # observations are almost always queried per datastream and time range
+        statements.append("""CREATE INDEX IF NOT EXISTS observations_datastream_resulttime_idx
+                                    ON observations (datastream, resulttime DESC);
+                                    """)
+
+        # observation ids are time-ordered (uuid7), so this index is filled append-only
+        statements.append("""CREATE INDEX IF NOT EXISTS observations_uuid_idx
+                                    ON observations (uuid);
+                                    """)
+
+        # compress older chunks column-wise, segmented by datastream so per-datastream scans only decompress their rows.
+        # the settings can not be changed once chunks are compressed, so they are only applied once
+        statements.append("""DO $$
+                             BEGIN
+                                IF NOT (SELECT compression_enabled FROM timescaledb_information.hypertables
+                                        WHERE hypertable_name = 'observations') THEN
+                                    ALTER TABLE observations SET (
+                                        timescaledb.compress,
+                                        timescaledb.compress_segmentby = 'datastream',
+                                        timescaledb.compress_orderby = 'resulttime DESC'
+                                    );
+                                END IF;
+                             END
+                             $$;
+                             """)
+        statements.append("""SELECT add_compression_policy(
+                                        'observations',
+                                        INTERVAL '7 days',
+                                        if_not_exists => TRUE
+                                    );
+                                    """)
+
         connection: Connection
         async with self._pool.acquire() as connection:
             async with connection.transaction():
@@ -101,11 +166,12 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
             self._es,
             [
                 (self.datastreams_index_name, self.datastream_mappings),
-            ])
+            ],
+            self._index_settings)
 
     async def close(self):
         await self._pool.close()
-        await self._es.close()
+        await close_elasticsearch(self._es_config)
 
     def get_conformance(self) -> List[str]:
         """Returns the list of conformance classes that are implemented by this provider"""
@@ -120,15 +186,25 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
         :returns: identifier of created item
         """
 
-        routines: List[Tuple[str, Dict]] = [None] * len(items)
+        if not items:
+            return []
+
         if type == "datastream":
-            # check if linked system exists
-            system_exists = await self._es.exists(index="systems", id=items[0]["system"])
-            if not system_exists:
-                raise ProviderItemNotFoundError(f"no system with id {items[0]['system']} found!")
+            # check if linked systems exist, using a single request for all referenced systems
+            system_ids = {item.get("system") for item in items}
+            if None in system_ids:
+                raise ProviderInvalidDataError("datastream is not linked to a system")
+            unknown = [system_id for system_id in system_ids if ("systems", system_id) not in self._known]
+            if unknown:
+                systems = await self._es.mget(index="systems", ids=unknown, source=False)
+                for doc in systems["docs"]:
+                    if not doc.get("found"):
+                        raise ProviderItemNotFoundError(f"no system with id {doc['_id']} found!")
+                    self._known.add(("systems", doc["_id"]))
 
             # create in elasticsearch
-            for i, item in enumerate(items):
+            routines: List[Tuple[str, Dict]] = []
+            for item in items:
                 if "id" not in item:
                     # We may have to generate id as it is not always required
                     identifier = str(uuid.uuid4())
@@ -136,14 +212,24 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
                 else:
                     identifier = item["id"]
 
-                routines[i] = (identifier, item)
-                return await create_many(self._es, self.datastreams_index_name, routines)
+                # parse date_range fields to es-compatible format
+                format_date_range("phenomenonTime", item)
+                format_date_range("resultTime", item)
+                routines.append((identifier, item))
+            created = await create_many(self._es, self.datastreams_index_name, routines, self._cache)
+            for identifier in created:
+                self._known.add((self.datastreams_index_name, identifier))
+            return created
         elif type == "observation":
             # check if linked datastream exists
-            datastream_id = items[0]['datastream']
-            datastream_exists = await self._es.exists(index=self.datastreams_index_name, id=datastream_id)
-            if not datastream_exists:
-                raise ProviderItemNotFoundError(f"no datastream with id {datastream_id} found!")
+            datastream_id = items[0].get("datastream")
+            if datastream_id is None:
+                raise ProviderInvalidDataError("observation is not linked to a datastream")
+            if (self.datastreams_index_name, datastream_id) not in self._known:
+                datastream_exists = await self._es.exists(index=self.datastreams_index_name, id=datastream_id)
+                if not datastream_exists:
+                    raise ProviderItemNotFoundError(f"no datastream with id {datastream_id} found!")
+                self._known.add((self.datastreams_index_name, datastream_id))
 
             # create in timescaledb
             # TODO: resolve to different parsers based on something?
@@ -152,24 +238,39 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
             raise ProviderGenericError(f"unrecognized type: {type}")
 
     async def put_observations(self, observations: List[Observation]) -> List[str]:
-        res = [""] * len(observations)
+        # ids are assigned by the parser, so the whole batch is sent at once without RETURNING each uuid
+        ids = [obs.id for obs in observations]
+        # write in time order, so consecutive rows land in the same hypertable chunk
+        observations = sorted(observations, key=_result_time_key)
         connection: Connection
         async with self._pool.acquire() as connection:
             async with connection.transaction():
-                # reformat to tuple
-                for idx, obs in enumerate(observations):
-                    # TODO: use prepared statement
-                    res[idx] = str(await connection.fetchval(
-                        "INSERT INTO observations (phenomenontime, resulttime, result, geom, foi, datastream, observedproperty) VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING uuid;",
-                        obs.phenomenonTime,
-                        obs.resultTime,
-                        obs.result,
-                        obs.geom,
-                        obs.foi,
-                        obs.datastream,
-                        obs.observedProperty
-                    ))
-        return res
+                if all(obs.geom is None for obs in observations):
+                    # COPY is the fastest bulk path, but requires binary codecs which asyncpg lacks for geometries
+                    await connection.copy_records_to_table(
+                        "observations",
+                        columns=("uuid", "phenomenontime", "resulttime", "result", "foi", "datastream",
+                                 "observedproperty"),
+                        records=[(obs.id,
+                                  obs.phenomenonTime,
+                                  obs.resultTime,
+                                  obs.result,
+                                  obs.foi,
+                                  obs.datastream,
+                                  obs.observedProperty) for obs in observations])
+                else:
+                    await connection.executemany(
+                        "INSERT INTO observations (uuid, phenomenontime, resulttime, result, geom, foi, datastream, "
+                        "observedproperty) VALUES ($1, $2, $3, $4, $5, $6, $7, $8);",
+                        [(obs.id,
+                          obs.phenomenonTime,
+                          obs.resultTime,
+                          obs.result,
+                          obs.geom,
+                          obs.foi,
+                          obs.datastream,
+                          obs.observedProperty) for obs in observations])
+        return ids
 
     async def update(self, identifier, item):
         """
@@ -201,16 +302,18 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
         :returns: dict of formatted properties
         """
 
-        query = Search(using=self._es, index=self.datastreams_index_name)
+        query = QueryBuilder()
         query = parse_csa_params(query, parameters)
         query = parse_temporal_filters(query, parameters)
 
-        LOGGER.debug(json.dumps(query.to_dict(), indent=True, default=str))
         if parameters.schema:
-            response = await search(self._es, self.datastreams_index_name, query.to_dict(), parameters)
-            return list(map(lambda x: x["schema"], response[0])), []
+            # only the schema is rendered, so skip transferring the rest of the document
+            response = await search(self._es, self.datastreams_index_name, query.to_dict(), parameters,
+                                    includes=("schema",), cache=self._cache)
+            return [x["schema"] for x in response[0]], []
         else:
-            return await search(self._es, self.datastreams_index_name, query.to_dict(), parameters)
+            return await search(self._es, self.datastreams_index_name, query.to_dict(), parameters,
+                                self.datastreams_source_excludes, cache=self._cache)
 
     async def query_observations(self, parameters: ObservationsParams) -> CSAGetResponse:
         """
@@ -241,23 +344,23 @@ class ConnectedSystemsTimescaleDBProvider(ConnectedSystemsPart2Provider):
 
         connection: Connection
         async with self._pool.acquire() as connection:
-            print("SELECT * FROM observations " + q.to_sql())
-            print(*q.parameters)
-            response = await connection.fetch("SELECT * FROM observations " + q.to_sql(), *q.parameters)
+            stub, values = q.to_sql()
+            sql = "SELECT * FROM observations " + stub
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug(f"{sql} {values}")
+            response = await connection.fetch(sql, *values)
 
             if len(response) > 0:
                 links = []
                 if len(response) == int(parameters.limit):
                     # page is fully filled - we assume a nextpage exists
-                    url = self.base_url
-                    if parameters.datastream:
-                        url += f"/datastreams/{parameters.datastream}"
                     links.append({
                         "title": "next",
                         "rel": "next",
                         "href": parameters.nextlink()
                     })
-                return [self.parser.encode(row) for row in response], links
+                encode = self.parser.encode
+                return [encode(row) for row in response], links
             else:
                 # check if this query returns 404 or 200 with empty body in case of no return
                 if parameters.id:
@@ -1,4 +1,7 @@
 import logging
+import os
+import time
+import uuid
 from typing import Self
 
 from ..definitions import *
@@ -6,6 +9,17 @@ from ..definitions import *
 LOGGER = logging.getLogger(__name__)
 
 
+def uuid7() -> uuid.UUID:
+    """
+    Generates a time-ordered UUID (version 7, RFC 9562): a 48 bit unix timestamp in milliseconds followed by random
+    bits. Ids generated later sort after earlier ones, so an index over them is filled append-only.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10))
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # version
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # variant
+    return uuid.UUID(int=value)
+
+
 @dataclass(slots=True)
 class Observation:
     id: str  # unique identifier
@@ -74,7 +88,7 @@ class ObservationQuery:
         return self._in("foi", ids)
 
     def with_datastream(self, id: str) -> Self:
-        self.clauses.append(f"datastream=${len(self.clauses) + 1}")
+        self.clauses.append(f"datastream=${len(self.parameters) + 1}")
         self.parameters.append(id)
         return self
 
@@ -92,7 +106,7 @@ class ObservationQuery:
         return self
 
     def _in(self, key: str, values: List[str]) -> Self:
-        self.clauses.append(f"{key}=any(${len(self.clauses) + 1})")
+        self.clauses.append(f"{key}=any(${len(self.parameters) + 1})")
         self.parameters.append(values)
         return self
 
@@ -101,14 +115,18 @@ class ObservationQuery:
             return self
 
         if time[0] is not None:
-            self.clauses.append(f"{key}>=${len(self.clauses) + 1}")
+            self.clauses.append(f"{key}>=${len(self.parameters) + 1}")
             self.parameters.append(time[0])
         if time[1] is not None:
-            self.clauses.append(f"{key}<=${len(self.clauses) + 1}")
+            self.clauses.append(f"{key}<=${len(self.parameters) + 1}")
             self.parameters.append(time[1])
         return self
 
-    def to_sql(self) -> str:
+    def to_sql(self) -> Tuple[str, List]:
+        """
+        Returns the filter statement and its parameters. Limit and offset are bound as parameters, so the statement
+        only depends on the set of filters and is reused from asyncpg's prepared statement cache.
+        """
         stub = ""
         # omit statement if none set
         if len(self.clauses) > 0:
@@ -116,9 +134,6 @@ class ObservationQuery:
             stub = "WHERE "
             stub += " AND ".join(self.clauses)
 
-        stub += f" LIMIT {self.limit}"
-        if self.offset > 0:
-            stub += f" OFFSET {self.offset}"
-
-        LOGGER.debug(f"querying with filter: {stub}")
-        return stub
+        n = len(self.parameters)
+        stub += f" LIMIT ${n + 1} OFFSET ${n + 2}"
+        return stub, [*self.parameters, self.limit, self.offset]
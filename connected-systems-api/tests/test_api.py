@@ -0,0 +1,30 @@
+import unittest
+
+from api import etag_matches
+
+ETAG = '"0123456789abcdef"'
+
+
+class EtagMatchesTest(unittest.TestCase):
+
+    def test_single_etag(self):
+        self.assertTrue(etag_matches(ETAG, ETAG))
+
+    def test_list_of_etags(self):
+        self.assertTrue(etag_matches(ETAG, f'"other", W/{ETAG} ,"another"'))
+        self.assertFalse(etag_matches(ETAG, '"other", "another"'))
+
+    def test_wildcard(self):
+        self.assertTrue(etag_matches(ETAG, '*'))
+
+    def test_substring_does_not_match(self):
+        self.assertFalse(etag_matches(ETAG, f'"x{ETAG}x"'))
+        self.assertFalse(etag_matches(ETAG, '"0123456789abcdef-gzip"'))
+
+    def test_missing_header(self):
+        self.assertFalse(etag_matches(ETAG, None))
+        self.assertFalse(etag_matches(ETAG, ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
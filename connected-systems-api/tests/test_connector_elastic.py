@@ -0,0 +1,162 @@
+import unittest
+import urllib.parse
+from unittest import mock
+
+from provider import connector_elastic
+from provider.connector_elastic import ElasticSearchConfig, connect_elasticsearch, close_elasticsearch, search, \
+    setup_elasticsearch, _encode_cursor, _decode_cursor
+from provider.definitions import ProceduresParams
+
+
+class FakeElasticsearch:
+    """ Records the requests sent by `search` and answers them with a fixed number of hits """
+
+    def __init__(self, hits: int):
+        self.hits = hits
+        self.searches = []
+        self.opened = []
+        self.closed = []
+
+    async def open_point_in_time(self, index, keep_alive):
+        self.opened.append(index)
+        return {"id": "pit-1"}
+
+    async def close_point_in_time(self, id):
+        self.closed.append(id)
+
+    async def search(self, body, **kwargs):
+        self.searches.append((body, kwargs))
+        return {
+            "pit_id": "pit-2",
+            "hits": {"hits": [{"_source": {"id": str(i)}, "sort": [i]} for i in range(self.hits)]}
+        }
+
+
+def _parameters(**kwargs) -> ProceduresParams:
+    parameters = ProceduresParams(limit=10, **kwargs)
+    parameters._url = "http://localhost/procedures"
+    return parameters
+
+
+def _next_cursor(links) -> str:
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(links[0]["href"]).query)["cursor"][0]
+
+
+class SearchPointInTimeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_first_page_opens_point_in_time(self):
+        es = FakeElasticsearch(hits=10)
+        body = {"query": {"match_all": {}}}
+
+        items, links = await search(es, "procedures", body, _parameters(offset=9990))
+
+        self.assertEqual(es.opened, ["procedures"])
+        request, _ = es.searches[0]
+        self.assertEqual(request["from"], 9990)
+        self.assertEqual(request["size"], 10)
+        self.assertEqual(request["pit"]["id"], "pit-1")
+        self.assertNotIn("search_after", request)
+        self.assertEqual(body, {"query": {"match_all": {}}})
+        self.assertEqual(len(items), 10)
+        self.assertEqual(_decode_cursor(_next_cursor(links)), ("pit-2", [9]))
+        self.assertEqual(es.closed, [])
+
+    async def test_cursor_page_continues_after_last_hit(self):
+        es = FakeElasticsearch(hits=10)
+
+        items, links = await search(es, "procedures", {}, _parameters(cursor=_encode_cursor("pit-2", [9])))
+
+        self.assertEqual(es.opened, [])
+        request, _ = es.searches[0]
+        self.assertEqual(request["search_after"], [9])
+        self.assertEqual(request["pit"]["id"], "pit-2")
+        self.assertNotIn("from", request)
+        self.assertEqual(len(links), 1)
+        self.assertEqual(es.closed, [])
+
+    async def test_last_page_closes_point_in_time(self):
+        es = FakeElasticsearch(hits=3)
+
+        items, links = await search(es, "procedures", {}, _parameters(cursor=_encode_cursor("pit-2", [19])))
+
+        self.assertEqual(len(items), 3)
+        self.assertEqual(links, [])
+        self.assertEqual(es.closed, ["pit-2"])
+
+
+class FakeIndices:
+    """ Records the index operations sent by `setup_elasticsearch` """
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.created = []
+        self.updated = []
+
+    async def exists(self, index):
+        return index in self.existing
+
+    async def create(self, index, mappings, settings):
+        self.created.append((index, mappings))
+
+    async def put_mapping(self, index, **mapping):
+        self.updated.append((index, mapping))
+
+
+class FakeCluster:
+
+    def __init__(self, existing):
+        self.indices = FakeIndices(existing)
+
+    async def ping(self):
+        return True
+
+    async def info(self):
+        return {"version": {"number": "8.15.0"}}
+
+
+class SetupElasticsearchTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_existing_indices_receive_new_mappings(self):
+        es = FakeCluster(existing={"datastreams", "collections"})
+        mapping = {"properties": {"resultTime_parsed": {"type": "date_range"}}}
+
+        await setup_elasticsearch(es, [("datastreams", mapping), ("collections", None), ("systems", mapping)])
+
+        self.assertEqual(es.indices.created, [("systems", mapping)])
+        self.assertEqual(es.indices.updated, [("datastreams", mapping)])
+
+
+class FakeClient:
+    """ Counts how often a client is closed """
+
+    def __init__(self, *args, **kwargs):
+        self.closed = 0
+
+    async def close(self):
+        self.closed += 1
+
+
+class SharedClientTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_client_is_closed_after_last_user(self):
+        part1 = ElasticSearchConfig(hostname="localhost", port=9200, user="elastic", password="", dbname="part1")
+        part2 = ElasticSearchConfig(hostname="localhost", port="9200", user="elastic", password="", dbname="part2")
+
+        with mock.patch.object(connector_elastic, "AsyncElasticsearch", FakeClient):
+            es = await connect_elasticsearch(part1)
+            self.assertIs(await connect_elasticsearch(part2), es)
+
+            await close_elasticsearch(part1)
+            self.assertEqual(es.closed, 0)
+            await close_elasticsearch(part2)
+            self.assertEqual(es.closed, 1)
+
+            fresh = await connect_elasticsearch(part1)
+            self.assertIsNot(fresh, es)
+            await close_elasticsearch(part1)
+            self.assertEqual(es.closed, 1)
+            self.assertEqual(fresh.closed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import unittest
+from datetime import datetime, timezone
+
+from elasticsearch import AsyncElasticsearch
+
+from provider.connector_elastic import QueryBuilder, create_many, format_date_range, parse_temporal_filters, \
+    search, setup_elasticsearch
+from provider.definitions import DatastreamsParams, parse_query_parameters
+from provider.part2.timescaledb_csa import ConnectedSystemsTimescaleDBProvider, _result_time_key
+from provider.part2.util import Observation
+
+ES_HOST = os.environ.get("CSA_TEST_ES_HOST")
+
+
+@unittest.skipUnless(ES_HOST, "requires an Elasticsearch instance, set CSA_TEST_ES_HOST")
+class DatastreamTemporalFilterTest(unittest.IsolatedAsyncioTestCase):
+    """ Runs the datastream temporal filters against a datastream indexed with the provider's mapping """
+    index = "test_datastreams"
+
+    async def asyncSetUp(self):
+        self.es = AsyncElasticsearch(f"https://{ES_HOST}:{os.environ.get('CSA_TEST_ES_PORT', 9200)}",
+                                     basic_auth=(os.environ.get("CSA_TEST_ES_USER", "elastic"),
+                                                 os.environ.get("CSA_TEST_ES_PASSWORD", "")),
+                                     verify_certs=False,
+                                     ssl_show_warn=False)
+        await self.es.options(ignore_status=404).indices.delete(index=self.index)
+        await setup_elasticsearch(self.es, [(self.index, ConnectedSystemsTimescaleDBProvider.datastream_mappings)])
+
+        item = {
+            "id": "datastream-1",
+            "system": "system-1",
+            "phenomenonTime": ["2024-01-01T00:00:00Z", "2024-01-31T00:00:00Z"],
+            "resultTime": ["2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z"],
+        }
+        format_date_range("phenomenonTime", item)
+        format_date_range("resultTime", item)
+        await create_many(self.es, self.index, [(item["id"], item)])
+        await self.es.indices.refresh(index=self.index)
+
+    async def asyncTearDown(self):
+        await self.es.options(ignore_status=404).indices.delete(index=self.index)
+        await self.es.close()
+
+    async def _query(self, **raw) -> list:
+        parameters = parse_query_parameters(DatastreamsParams(), raw, "http://localhost/datastreams")
+        query = parse_temporal_filters(QueryBuilder(), parameters)
+        response = await search(self.es, self.index, query.to_dict(), parameters,
+                                ConnectedSystemsTimescaleDBProvider.datastreams_source_excludes)
+        return [item["id"] for item in response[0]]
+
+    async def test_result_time_filter(self):
+        self.assertEqual(await self._query(resultTime="2024-01-15T00:00:00Z"), ["datastream-1"])
+        self.assertEqual(await self._query(resultTime="2024-01-20T00:00:00Z/2024-03-01T00:00:00Z"),
+                         ["datastream-1"])
+        self.assertEqual(await self._query(resultTime="2024-03-01T00:00:00Z"), [])
+
+    async def test_phenomenon_time_filter(self):
+        self.assertEqual(await self._query(phenomenonTime="2024-01-15T00:00:00Z"), ["datastream-1"])
+        self.assertEqual(await self._query(phenomenonTime="2024-02-15T00:00:00Z"), [])
+
+    async def test_parsed_fields_are_not_returned(self):
+        parameters = parse_query_parameters(DatastreamsParams(), {}, "http://localhost/datastreams")
+        response = await search(self.es, self.index, QueryBuilder().to_dict(), parameters,
+                                ConnectedSystemsTimescaleDBProvider.datastreams_source_excludes)
+        self.assertNotIn("resultTime_parsed", response[0][0])
+        self.assertNotIn("phenomenonTime_parsed", response[0][0])
+
+
+class ResultTimeOrderTest(unittest.TestCase):
+
+    def test_mixed_offset_aware_and_naive_result_times(self):
+        times = [datetime(2024, 1, 2, tzinfo=timezone.utc), datetime(2024, 1, 1), datetime(2024, 1, 3)]
+        observations = [Observation(id=str(i), resultTime=t, phenomenonTime=t, result=None, geom=None, foi=None,
+                                    datastream="datastream-1", observedProperty=None)
+                        for i, t in enumerate(times)]
+
+        ordered = sorted(observations, key=_result_time_key)
+
+        self.assertEqual([obs.id for obs in ordered], ["1", "0", "2"])
+
+
+if __name__ == '__main__':
+    unittest.main()